@@ -1,5 +1,17 @@
+import asyncio
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+import httpx
 from langchain.agents import AgentType, Tool, initialize_agent
-from langchain.memory import ConversationBufferMemory
+from langchain.memory import (ConversationBufferMemory,
+                              ConversationBufferWindowMemory,
+                              ConversationSummaryBufferMemory)
+from langchain_core.caches import InMemoryCache
+from langchain_core.globals import set_llm_cache
+from langchain_core.messages import BaseMessage
 from langchain_core.prompts import PromptTemplate
 from langchain_openai import OpenAI
 
@@ -8,31 +20,120 @@ from app.tools.rag_tool import rag_tool
 from app.tools.web_search_tool import web_search_tool
 
 
-class JapaneseLawAgent:
-    def __init__(self):
-        # Initialize the LLM
-        self.llm = OpenAI(
-            openai_api_key=settings.OPENAI_API_KEY,
-            model_name=settings.MODEL_NAME,
-            temperature=0.1,  # Lower temperature for more consistent answers in legal domain
+def _init_llm_cache():
+    """
+    Install the global LLM response cache selected by settings.LLM_CACHE
+
+    "memory" caches up to LLM_CACHE_SIZE responses per process; "redis"
+    shares the cache between workers.
+    """
+    if settings.LLM_CACHE == "memory":
+        set_llm_cache(InMemoryCache(maxsize=settings.LLM_CACHE_SIZE))
+    elif settings.LLM_CACHE == "redis":
+        from langchain_community.cache import RedisCache
+        from redis import Redis
+
+        set_llm_cache(
+            RedisCache(
+                redis_=Redis.from_url(settings.REDIS_URL),
+                ttl=settings.LLM_CACHE_TTL,
+            )
         )
 
+
+_init_llm_cache()
+
+# HTTP connection pools shared by every agent instance
+_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+http_client = httpx.Client(limits=_HTTP_LIMITS)
+http_async_client = httpx.AsyncClient(limits=_HTTP_LIMITS)
+
+# The LLM client and tools are stateless, so they are shared across requests
+llm = OpenAI(
+    openai_api_key=settings.OPENAI_API_KEY,
+    model_name=settings.MODEL_NAME,
+    temperature=0.1,  # Lower temperature for more consistent answers in legal domain
+    http_client=http_client,
+    http_async_client=http_async_client,
+)
+
+# Tool results memoized for the agent run of the current request
+_TOOL_CALL_CACHE: ContextVar[Optional[Dict]] = ContextVar(
+    "tool_call_cache", default=None
+)
+
+
+@contextmanager
+def _tool_call_scope():
+    """Deduplicate identical tool calls made while the block runs"""
+    token = _TOOL_CALL_CACHE.set({})
+    try:
+        yield
+    finally:
+        _TOOL_CALL_CACHE.reset(token)
+
+
+def _dedup_tool_calls(name: str, func: Callable) -> Callable:
+    """Wrap a tool function so repeated calls within one agent run are served once"""
+    if asyncio.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            cache = _TOOL_CALL_CACHE.get()
+            if cache is None:
+                return await func(*args, **kwargs)
+            key = (name, args, tuple(sorted(kwargs.items())))
+            if key not in cache:
+                cache[key] = await func(*args, **kwargs)
+            return cache[key]
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        cache = _TOOL_CALL_CACHE.get()
+        if cache is None:
+            return func(*args, **kwargs)
+        key = (name, args, tuple(sorted(kwargs.items())))
+        if key not in cache:
+            cache[key] = func(*args, **kwargs)
+        return cache[key]
+
+    return wrapper
+
+
+tools = [
+    Tool(
+        name=rag_tool.name,
+        func=_dedup_tool_calls(rag_tool.name, rag_tool._run),
+        coroutine=_dedup_tool_calls(rag_tool.name, rag_tool._arun),
+        description=rag_tool.description,
+    ),
+    Tool(
+        name=web_search_tool.name,
+        func=_dedup_tool_calls(web_search_tool.name, web_search_tool._run),
+        coroutine=_dedup_tool_calls(web_search_tool.name, web_search_tool._arun),
+        description=web_search_tool.description,
+    ),
+]
+
+
+class JapaneseLawAgent:
+    """
+    Agent for a single request; conversation memory is seeded from chat_history
+    so no state is shared between users.
+    """
+
+    def __init__(self, chat_history: Optional[List[BaseMessage]] = None):
+        self.llm = llm
+
         # Initialize memory for conversation history
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history", return_messages=True
-        )
+        self.memory = self._build_memory()
+        if chat_history:
+            self.memory.chat_memory.add_messages(chat_history)
 
         # Define tools for the agent
-        self.tools = [
-            Tool(
-                name=rag_tool.name, func=rag_tool._run, description=rag_tool.description
-            ),
-            Tool(
-                name=web_search_tool.name,
-                func=web_search_tool._run,
-                description=web_search_tool.description,
-            ),
-        ]
+        self.tools = tools
 
         # Create the agent
         self.agent = initialize_agent(
@@ -59,6 +160,29 @@ class JapaneseLawAgent:
         {chat_history}
         """
 
+    def _build_memory(self):
+        """
+        Create the conversation memory selected by settings.MEMORY_STRATEGY
+
+        "summary_buffer" summarizes turns beyond MEMORY_MAX_TOKEN_LIMIT,
+        "window" keeps the last MAX_HISTORY_LENGTH turns verbatim and
+        "buffer" keeps the whole conversation.
+        """
+        if settings.MEMORY_STRATEGY == "summary_buffer":
+            return ConversationSummaryBufferMemory(
+                llm=self.llm,
+                max_token_limit=settings.MEMORY_MAX_TOKEN_LIMIT,
+                memory_key="chat_history",
+                return_messages=True,
+            )
+        if settings.MEMORY_STRATEGY == "window":
+            return ConversationBufferWindowMemory(
+                k=settings.MAX_HISTORY_LENGTH,
+                memory_key="chat_history",
+                return_messages=True,
+            )
+        return ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+
     def query(self, user_input: str):
         """
         Process a user query using the agent
@@ -66,11 +190,36 @@ class JapaneseLawAgent:
         try:
             # For now, using the standard agent without custom prompt
             # In a full implementation, we would customize the agent's prompt
-            response = self.agent(user_input)
+            with _tool_call_scope():
+                response = self.agent(user_input)
+            return response
+        except Exception as e:
+            return {"error": f"Error processing query: {str(e)}"}
+
+    async def aquery(self, user_input: str):
+        """
+        Process a user query using the agent without blocking the event loop
+        """
+        if not settings.USE_ASYNC_AGENT:
+            # Rollback path: run the sync agent in a worker thread
+            return await asyncio.to_thread(self.query, user_input)
+        try:
+            with _tool_call_scope():
+                response = await self.agent.ainvoke({"input": user_input})
             return response
         except Exception as e:
             return {"error": f"Error processing query: {str(e)}"}
 
+    async def astream_events(self, user_input: str):
+        """
+        Stream the agent run as LangChain events (including LLM tokens)
+        """
+        with _tool_call_scope():
+            async for event in self.agent.astream_events(
+                {"input": user_input}, version="v2"
+            ):
+                yield event
+
     def reset_memory(self):
         """
         Reset the conversation memory
@@ -78,5 +227,27 @@ class JapaneseLawAgent:
         self.memory.clear()
 
 
-# Global instance
-law_agent = JapaneseLawAgent()
+def build_agent(chat_history: Optional[List[BaseMessage]] = None) -> JapaneseLawAgent:
+    """
+    Create a request-scoped agent on top of the shared LLM client and tools
+    """
+    agent = JapaneseLawAgent(chat_history)
+    if isinstance(agent.memory, ConversationSummaryBufferMemory):
+        # The summary buffer only prunes in save_context, i.e. after the run;
+        # summarize the seeded history before this turn's prompt is built so
+        # MEMORY_MAX_TOKEN_LIMIT applies to it
+        agent.memory.prune()
+    return agent
+
+
+async def abuild_agent(
+    chat_history: Optional[List[BaseMessage]] = None,
+) -> JapaneseLawAgent:
+    """
+    Async version of build_agent; the summarization call does not block the
+    event loop
+    """
+    agent = JapaneseLawAgent(chat_history)
+    if isinstance(agent.memory, ConversationSummaryBufferMemory):
+        await agent.memory.aprune()
+    return agent
@@ -1,37 +1,49 @@
 from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.db.base import get_db
+from app.core.db.base import get_async_db
 from app.schemas.chat import ChatRequest, ChatResponse, ConversationHistory
 from app.services.chat_service import (get_conversation_history,
                                        get_user_conversations,
-                                       process_chat_request)
+                                       process_chat_request,
+                                       stream_chat_request)
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
 
 @router.post("/message", response_model=ChatResponse)
-def chat(chat_request: ChatRequest, db: Session = Depends(get_db)):
+async def chat(chat_request: ChatRequest, db: AsyncSession = Depends(get_async_db)):
     """Send a message and receive a response from the Japanese law AI agent"""
     try:
-        response = process_chat_request(db, chat_request)
+        response = await process_chat_request(db, chat_request)
         return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/stream")
+async def chat_stream(chat_request: ChatRequest):
+    """Send a message and stream the agent's response as server-sent events"""
+    return StreamingResponse(
+        stream_chat_request(chat_request), media_type="text/event-stream"
+    )
+
+
 @router.get("/conversation/{conversation_id}", response_model=ConversationHistory)
-def get_conversation(conversation_id: int, db: Session = Depends(get_db)):
+async def get_conversation(
+    conversation_id: int, db: AsyncSession = Depends(get_async_db)
+):
     """Get the history of a specific conversation"""
-    history = get_conversation_history(db, conversation_id)
+    history = await get_conversation_history(db, conversation_id)
     if not history:
         raise HTTPException(status_code=404, detail="Conversation not found")
     return history
 
 
 @router.get("/user/{user_id}/conversations", response_model=List[ConversationHistory])
-def get_conversations(user_id: int, db: Session = Depends(get_db)):
-    """Get all conversations for a specific user"""
-    return get_user_conversations(db, user_id)
+async def get_conversations(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Get all conversations for a user"""
+    return await get_user_conversations(db, user_id)
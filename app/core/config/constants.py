@@ -47,3 +47,8 @@ ERROR_MESSAGES = {
 # Default values
 DEFAULT_TOP_K = 5
 DEFAULT_SEARCH_RADIUS = 1.0
+CONTENT_PREVIEW_LENGTH = 500
+
+# Embedding model used for RAG queries
+EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+EMBEDDING_DIM = 384
@@ -21,10 +21,15 @@ class Settings(BaseSettings):
     MILVUS_USER: str = ""
     MILVUS_PASSWORD: str = ""
     COLLECTION_NAME: str = ""
+    MILVUS_POOL_SIZE: int = 4
 
     # LLM Configuration
     OPENAI_API_KEY: str = ""
     MODEL_NAME: str = ""
+    LLM_CACHE: str = "memory"
+    LLM_CACHE_TTL: int = 3600
+    LLM_CACHE_SIZE: int = 1000
+    REDIS_URL: str = "redis://localhost:6379/0"
 
     # Ollama Configuration
     OLLAMA_IP: str = ""
@@ -34,9 +39,35 @@ class Settings(BaseSettings):
     # Application Configuration
     DEBUG: bool = False
     MAX_HISTORY_LENGTH: int = 0
+    MEMORY_STRATEGY: str = "summary_buffer"
+    MEMORY_MAX_TOKEN_LIMIT: int = 512
+    USE_ASYNC_AGENT: bool = True
+    MAX_CONCURRENT_AGENT_CALLS: int = 32
+
+    # Embedding Cache Configuration
+    USE_EMB_CACHE: bool = True
+    EMB_CACHE_SIZE: int = 10000
+    USE_SEMANTIC_CACHE: bool = True
+    SEMANTIC_CACHE_SIZE: int = 10000
+    SEMANTIC_CACHE_THRESHOLD: float = 0.05
+
+    # Embedding Batching Configuration
+    EMB_BATCH_SIZE: int = 32
+    EMB_BATCH_WAIT_MS: float = 15
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
+    @property
+    def DATABASE_URL(self) -> str:
+        return (
+            f"postgresql://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}"
+            f"@{self.POSTGRES_SERVER}/{self.POSTGRES_DB}"
+        )
+
+    @property
+    def ASYNC_DATABASE_URL(self) -> str:
+        return self.DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+
 
 if not Path(".env").is_file():
     copy(".env.example", ".env")
@@ -49,9 +80,6 @@ env_list = (
     ".env.test",
 )
 settings = Settings(
-    _env_file=filter(
-        lambda env: Path(env).is_file(),
-        env_list,
-    ),
+    _env_file=tuple(env for env in env_list if Path(env).is_file()),
     _env_file_encoding="utf-8",
 )
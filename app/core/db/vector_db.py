@@ -1,26 +1,47 @@
-from typing import Any, Dict, List, Optional
+import asyncio
+import itertools
+import threading
+from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
 from pymilvus import (Collection, CollectionSchema, DataType, FieldSchema,
                       connections, utility)
 
-from app.config.constants import DEFAULT_TOP_K
-from app.config.settings import settings
+from app.core.config.constants import (CONTENT_PREVIEW_LENGTH, DEFAULT_TOP_K,
+                                      EMBEDDING_DIM)
+from app.core.config.settings import settings
+
+# HNSW gives lower search latency than IVF_FLAT at the same recall;
+# raise "ef" for better recall at the cost of latency
+INDEX_PARAMS = {
+    "index_type": "HNSW",
+    "metric_type": "COSINE",
+    "params": {"M": 16, "efConstruction": 200},
+}
+SEARCH_PARAMS = {"metric_type": "COSINE", "params": {"ef": 64}}
 
 
 class VectorDBManager:
     def __init__(self):
         self.collection_name = settings.COLLECTION_NAME
+        self._collection: Optional[Collection] = None
+        self._collection_lock = threading.Lock()
+        self._pool_aliases = [f"milvus_{i}" for i in range(settings.MILVUS_POOL_SIZE)]
+        self._next_alias = itertools.cycle(self._pool_aliases)
+        self._local = threading.local()
         self.connect()
+        self.get_collection()
 
     def connect(self):
-        """Connect to Milvus server"""
-        connections.connect(
-            alias="default",
-            host=settings.MILVUS_HOST,
-            port=settings.MILVUS_PORT,
-            user=settings.MILVUS_USER,
-            password=settings.MILVUS_PASSWORD,
-        )
+        """Connect to Milvus server, plus one pooled connection per alias"""
+        for alias in ["default", *self._pool_aliases]:
+            connections.connect(
+                alias=alias,
+                host=settings.MILVUS_HOST,
+                port=settings.MILVUS_PORT,
+                user=settings.MILVUS_USER,
+                password=settings.MILVUS_PASSWORD,
+            )
 
     def create_collection_if_not_exists(self):
         """Create collection if it doesn't exist"""
@@ -30,12 +51,16 @@ class VectorDBManager:
                     name="id", dtype=DataType.INT64, is_primary=True, auto_id=True
                 ),
                 FieldSchema(
-                    name="embedding", dtype=DataType.FLOAT_VECTOR, dim=1536
-                ),  # Assuming OpenAI embeddings
+                    name="embedding", dtype=DataType.FLOAT16_VECTOR, dim=EMBEDDING_DIM
+                ),  # Stored as fp16 to halve memory and scan bandwidth
                 FieldSchema(name="law_title", dtype=DataType.VARCHAR, max_length=500),
                 FieldSchema(
                     name="law_content", dtype=DataType.VARCHAR, max_length=65535
                 ),
+                # max_length is in bytes; leaves room for multi-byte Japanese text
+                FieldSchema(
+                    name="law_content_preview", dtype=DataType.VARCHAR, max_length=2048
+                ),
                 FieldSchema(
                     name="law_category", dtype=DataType.VARCHAR, max_length=100
                 ),
@@ -47,52 +72,86 @@ class VectorDBManager:
             collection = Collection(name=self.collection_name, schema=schema)
 
             # Create index
-            index_params = {
-                "index_type": "IVF_FLAT",
-                "metric_type": "COSINE",
-                "params": {"nlist": 1024},
-            }
-            collection.create_index(field_name="embedding", index_params=index_params)
+            collection.create_index(field_name="embedding", index_params=INDEX_PARAMS)
 
             return collection
         else:
             return Collection(self.collection_name)
 
-    def insert_law_document(self, embedding: List[float], law_data: Dict[str, Any]):
-        """Insert a law document into the collection"""
-        collection = self.create_collection_if_not_exists()
-
-        data = [
-            [embedding],
-            [law_data.get("title", "")],
-            [law_data.get("content", "")],
-            [law_data.get("category", "")],
-            [law_data.get("date", "")],
-            [law_data.get("metadata", {})],
-        ]
+    def get_collection(self) -> Collection:
+        """Return the collection handle, creating and loading it once"""
+        if self._collection is None:
+            with self._collection_lock:
+                if self._collection is None:
+                    collection = self.create_collection_if_not_exists()
+                    collection.load()  # Load collection into memory for searching
+                    self._collection = collection
+        return self._collection
+
+    def _thread_collection(self) -> Collection:
+        """Return a collection handle on the pooled connection of this thread"""
+        collection = getattr(self._local, "collection", None)
+        if collection is None:
+            self.get_collection()  # Make sure it exists and is loaded
+            with self._collection_lock:
+                alias = next(self._next_alias)
+            collection = Collection(self.collection_name, using=alias)
+            self._local.collection = collection
+        return collection
+
+    def insert_many(
+        self, rows: List[Tuple[List[float], Dict[str, Any]]], flush: bool = True
+    ):
+        """Insert many law documents with a single insert call"""
+        collection = self.get_collection()
+
+        embeddings = []
+        titles = []
+        contents = []
+        previews = []
+        categories = []
+        dates = []
+        metadata = []
+        for embedding, law_data in rows:
+            embeddings.append(np.asarray(embedding, dtype=np.float16))
+            titles.append(law_data.get("title", ""))
+            content = law_data.get("content", "")
+            contents.append(content)
+            previews.append(
+                content[:CONTENT_PREVIEW_LENGTH] + "..."
+                if len(content) > CONTENT_PREVIEW_LENGTH
+                else content
+            )
+            categories.append(law_data.get("category", ""))
+            dates.append(law_data.get("date", ""))
+            metadata.append(law_data.get("metadata", {}))
 
-        result = collection.insert(data)
-        collection.load()  # Load collection into memory for searching
+        result = collection.insert(
+            [embeddings, titles, contents, previews, categories, dates, metadata]
+        )
+        if flush:
+            collection.flush()
 
         return result.insert_ids
 
+    def insert_law_document(self, embedding: List[float], law_data: Dict[str, Any]):
+        """Insert a law document into the collection"""
+        return self.insert_many([(embedding, law_data)], flush=False)
+
     def search_similar_laws(
         self, query_embedding: List[float], top_k: int = DEFAULT_TOP_K
     ) -> List[Dict[str, Any]]:
         """Search for similar law documents based on embedding similarity"""
-        collection = Collection(self.collection_name)
-        collection.load()  # Ensure collection is loaded
-
-        search_params = {"metric_type": "COSINE", "params": {"nprobe": 10}}
+        collection = self._thread_collection()
 
         results = collection.search(
-            data=[query_embedding],
+            data=[np.asarray(query_embedding, dtype=np.float16)],
             anns_field="embedding",
-            param=search_params,
+            param=SEARCH_PARAMS,
             limit=top_k,
             output_fields=[
                 "law_title",
-                "law_content",
+                "law_content_preview",
                 "law_category",
                 "law_date",
                 "metadata",
@@ -107,7 +166,7 @@ class VectorDBManager:
                     "id": hit.id,
                     "distance": hit.distance,
                     "title": hit.entity.get("law_title"),
-                    "content": hit.entity.get("law_content"),
+                    "content": hit.entity.get("law_content_preview"),
                     "category": hit.entity.get("law_category"),
                     "date": hit.entity.get("law_date"),
                     "metadata": hit.entity.get("metadata"),
@@ -116,10 +175,26 @@ class VectorDBManager:
 
         return formatted_results
 
+    async def asearch_similar_laws(
+        self, query_embedding: List[float], top_k: int = DEFAULT_TOP_K
+    ) -> List[Dict[str, Any]]:
+        """Async version of search_similar_laws; the search runs in a worker thread"""
+        return await asyncio.to_thread(self.search_similar_laws, query_embedding, top_k)
+
+    def rebuild_index(self):
+        """Replace the embedding index of an existing collection with INDEX_PARAMS"""
+        collection = self.get_collection()
+        collection.release()
+        collection.drop_index()
+        collection.create_index(field_name="embedding", index_params=INDEX_PARAMS)
+        collection.load()
+
     def delete_collection(self):
         """Delete the entire collection (use carefully!)"""
-        if utility.has_collection(self.collection_name):
-            utility.drop_collection(self.collection_name)
+        with self._collection_lock:
+            if utility.has_collection(self.collection_name):
+                utility.drop_collection(self.collection_name)
+            self._collection = None
 
 
 # Global instance
@@ -1,15 +1,17 @@
 from datetime import datetime
 
-from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Integer, String,
-                        Text)
+from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Index, Integer,
+                        String, Text)
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
-from app.database.base import Base
+from app.core.db.base import Base
 
 
 class Conversation(Base):
     __tablename__ = "conversations"
+    __table_args__ = (Index("ix_conversations_user_updated", "user_id", "updated_at"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -26,13 +28,15 @@ class Conversation(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    # Serves history queries (filter by conversation, order by time) from one index scan
+    __table_args__ = (Index("ix_messages_conv_ts", "conversation_id", "timestamp"),)
 
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
     role = Column(String(50), nullable=False)  # user, assistant, system
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
-    metadata_json = Column(Text)  # Store additional metadata as JSON
+    metadata_json = Column(JSONB)  # Store additional metadata as JSON
 
     # Relationship
     conversation = relationship("Conversation", back_populates="messages")
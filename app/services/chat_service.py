@@ -1,81 +1,130 @@
+import asyncio
+import json
 from datetime import datetime
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 
-from sqlalchemy.orm import Session
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from sqlalchemy import and_, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
-from app.agents.law_agent import law_agent
+from app.agents.law_agent import abuild_agent
 from app.core.config.constants import ERROR_MESSAGES
+from app.core.config.settings import settings
+from app.core.db.base import AsyncSessionLocal
 from app.core.db.vector_db import vector_db
 from app.models.conversation import Conversation, Message, User
 from app.schemas.chat import (ChatRequest, ChatResponse, ConversationHistory,
                               MessageHistory)
 
+# Bounds concurrent agent runs so their Milvus searches stay within the pool
+_AGENT_SEMAPHORE = asyncio.Semaphore(settings.MAX_CONCURRENT_AGENT_CALLS)
 
-def create_conversation(db: Session, user_id: int, title: str) -> Conversation:
+
+async def create_conversation(
+    db: AsyncSession, user_id: int, title: str
+) -> Conversation:
     """Create a new conversation record"""
     conversation = Conversation(user_id=user_id, title=title)
     db.add(conversation)
-    db.commit()
-    db.refresh(conversation)
+    await db.commit()
+    await db.refresh(conversation)
     return conversation
 
 
-def get_or_create_conversation(
-    db: Session, user_id: int, conversation_id: Optional[int] = None
+async def get_or_create_conversation(
+    db: AsyncSession, user_id: int, conversation_id: Optional[int] = None
 ) -> Conversation:
     """Get existing conversation or create a new one"""
     if conversation_id:
-        conversation = (
-            db.query(Conversation).filter(Conversation.id == conversation_id).first()
+        conversation = await db.scalar(
+            select(Conversation).where(Conversation.id == conversation_id)
         )
         if not conversation:
             raise ValueError(f"Conversation with id {conversation_id} not found")
     else:
         # Create a new conversation
         title = "New Legal Inquiry"  # This would ideally be generated based on the first query
-        conversation = create_conversation(db, user_id, title)
+        conversation = await create_conversation(db, user_id, title)
 
     return conversation
 
 
-def save_message(
-    db: Session, conversation_id: int, role: str, content: str, metadata: dict = None
+async def save_message(
+    db: AsyncSession,
+    conversation_id: int,
+    role: str,
+    content: str,
+    metadata: dict = None,
 ) -> Message:
     """Save a message to the conversation"""
     message = Message(
         conversation_id=conversation_id,
         role=role,
         content=content,
-        metadata_json=str(metadata) if metadata else None,
+        metadata_json=metadata or None,
     )
     db.add(message)
-    db.commit()
-    db.refresh(message)
+    await db.commit()
+    await db.refresh(message)
     return message
 
 
-def process_chat_request(db: Session, chat_request: ChatRequest) -> ChatResponse:
+async def get_recent_messages(
+    db: AsyncSession, conversation_id: int, limit: int
+) -> List[BaseMessage]:
+    """Load the latest messages of a conversation as LangChain messages"""
+    if limit <= 0:
+        return []
+    messages = (
+        await db.scalars(
+            select(Message)
+            .where(Message.conversation_id == conversation_id)
+            .order_by(Message.timestamp.desc())
+            .limit(limit)
+        )
+    ).all()
+
+    history = []
+    for msg in reversed(messages):
+        if msg.role == "user":
+            history.append(HumanMessage(content=msg.content))
+        elif msg.role == "assistant":
+            history.append(AIMessage(content=msg.content))
+    return history
+
+
+async def process_chat_request(
+    db: AsyncSession, chat_request: ChatRequest
+) -> ChatResponse:
     """Process a chat request using the law agent"""
     try:
         # Get or create conversation
-        conversation = get_or_create_conversation(
+        conversation = await get_or_create_conversation(
             db, chat_request.user_id, chat_request.conversation_id
         )
 
-        # Save user message
-        save_message(db, conversation.id, "user", chat_request.message)
+        # Prepare context for the agent from the recent conversation history
+        chat_history = await get_recent_messages(
+            db, conversation.id, settings.MAX_HISTORY_LENGTH * 2
+        )
+        law_agent = await abuild_agent(chat_history)
 
-        # Prepare context for the agent
-        # In a real implementation, we'd fetch recent conversation history
+        async def query_agent():
+            async with _AGENT_SEMAPHORE:
+                return await law_agent.aquery(chat_request.message)
 
-        # Query the law agent
-        agent_response = law_agent.query(chat_request.message)
+        # Save user message while the law agent is queried
+        _, agent_response = await asyncio.gather(
+            save_message(db, conversation.id, "user", chat_request.message),
+            query_agent(),
+        )
 
         # Extract the actual response text
         response_text = agent_response.get("output", str(agent_response))
 
         # Save assistant message
-        save_message(db, conversation.id, "assistant", response_text)
+        await save_message(db, conversation.id, "assistant", response_text)
 
         # For now, no sources are returned - this would come from the agent's tool usage
         sources = []  # Extract from agent response in a full implementation
@@ -92,12 +141,57 @@ def process_chat_request(db: Session, chat_request: ChatRequest) -> ChatResponse
         )
 
 
-def get_conversation_history(
-    db: Session, conversation_id: int
+def _sse(data) -> str:
+    """Format a payload as a server-sent event"""
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_chat_request(chat_request: ChatRequest) -> AsyncIterator[str]:
+    """Process a chat request, yielding LLM tokens as server-sent events"""
+    # The request-scoped session of the route may be closed before the
+    # streaming body runs, so the stream owns its session
+    async with AsyncSessionLocal() as db:
+        try:
+            conversation = await get_or_create_conversation(
+                db, chat_request.user_id, chat_request.conversation_id
+            )
+            yield _sse({"conversation_id": conversation.id})
+
+            chat_history = await get_recent_messages(
+                db, conversation.id, settings.MAX_HISTORY_LENGTH * 2
+            )
+            law_agent = await abuild_agent(chat_history)
+            await save_message(db, conversation.id, "user", chat_request.message)
+
+            response_text = ""
+            async with _AGENT_SEMAPHORE:
+                async for event in law_agent.astream_events(chat_request.message):
+                    kind = event["event"]
+                    if kind == "on_llm_stream":
+                        yield _sse({"text": event["data"]["chunk"].text})
+                    elif kind == "on_chat_model_stream":
+                        yield _sse({"text": event["data"]["chunk"].content})
+                    elif kind == "on_chain_end" and not event.get("parent_ids"):
+                        output = event["data"].get("output")
+                        response_text = (
+                            output.get("output", str(output))
+                            if isinstance(output, dict)
+                            else str(output)
+                        )
+
+            await save_message(db, conversation.id, "assistant", response_text)
+            yield _sse({"output": response_text})
+        except Exception as e:
+            yield _sse({"error": f"{ERROR_MESSAGES['UNKNOWN_ERROR']}: {str(e)}"})
+        yield "data: [DONE]\n\n"
+
+
+async def get_conversation_history(
+    db: AsyncSession, conversation_id: int
 ) -> Optional[ConversationHistory]:
     """Retrieve conversation history"""
-    conversation = (
-        db.query(Conversation).filter(Conversation.id == conversation_id).first()
+    conversation = await db.scalar(
+        select(Conversation).where(Conversation.id == conversation_id)
     )
 
     if not conversation:
@@ -105,11 +199,12 @@ def get_conversation_history(
 
     # Get messages in chronological order
     messages = (
-        db.query(Message)
-        .filter(Message.conversation_id == conversation_id)
-        .order_by(Message.timestamp)
-        .all()
-    )
+        await db.scalars(
+            select(Message)
+            .where(Message.conversation_id == conversation_id)
+            .order_by(Message.timestamp)
+        )
+    ).all()
 
     formatted_messages = [
         MessageHistory(role=msg.role, content=msg.content, timestamp=msg.timestamp)
@@ -125,20 +220,44 @@ def get_conversation_history(
     )
 
 
-def get_user_conversations(db: Session, user_id: int) -> List[ConversationHistory]:
+async def get_user_conversations(
+    db: AsyncSession, user_id: int
+) -> List[ConversationHistory]:
     """Get all conversations for a user"""
-    conversations = db.query(Conversation).filter(Conversation.user_id == user_id).all()
+    # Number each conversation's messages by time so the first message of every
+    # conversation can be joined in the same query
+    numbered_messages = (
+        select(
+            Message,
+            func.row_number()
+            .over(partition_by=Message.conversation_id, order_by=Message.timestamp)
+            .label("position"),
+        )
+        .where(
+            Message.conversation_id.in_(
+                select(Conversation.id).where(Conversation.user_id == user_id)
+            )
+        )
+        .subquery()
+    )
+    FirstMessage = aliased(Message, numbered_messages)
 
-    result = []
-    for conv in conversations:
-        # Get the first message to include in conversation overview
-        first_message = (
-            db.query(Message)
-            .filter(Message.conversation_id == conv.id)
-            .order_by(Message.timestamp)
-            .first()
+    rows = (
+        await db.execute(
+            select(Conversation, FirstMessage)
+            .outerjoin(
+                FirstMessage,
+                and_(
+                    FirstMessage.conversation_id == Conversation.id,
+                    numbered_messages.c.position == 1,
+                ),
+            )
+            .where(Conversation.user_id == user_id)
         )
+    ).all()
 
+    result = []
+    for conv, first_message in rows:
         result.append(
             ConversationHistory(
                 conversation_id=conv.id,
@@ -146,11 +265,9 @@ def get_user_conversations(db: Session, user_id: int) -> List[ConversationHistor
                 messages=(
                     [
                         MessageHistory(
-                            role=first_message.role if first_message else "",
-                            content=first_message.content if first_message else "",
-                            timestamp=(
-                                first_message.timestamp if first_message else None
-                            ),
+                            role=first_message.role,
+                            content=first_message.content,
+                            timestamp=first_message.timestamp,
                         )
                     ]
                     if first_message
@@ -1,10 +1,118 @@
-from typing import Any, Type
+"""
+RAG search tool over the Japanese law collection in Milvus.
+
+The embedding tokenizer/model are loaded once per process on first use and
+shared by every RAGTool instance (the multilingual MiniLM weights take roughly
+450MB of RAM, or half of that as fp16 on GPU), so a query only pays for the
+forward pass. Query embeddings are
+additionally kept in a process-wide LRU cache keyed by the normalized query
+text (~1.5KB per entry), which can be disabled with USE_EMB_CACHE=false.
+Search results are cached by embedding proximity (see SemanticCache), so
+paraphrased queries can skip the Milvus round-trip as well. Cache misses from
+concurrent requests are embedded together by an EmbeddingBatcher.
+"""
+
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Type
 
 from langchain.tools import BaseTool
 from pydantic import BaseModel, Field
 
-from app.core.config.constants import DEFAULT_TOP_K
+from app.core.config.constants import DEFAULT_TOP_K, EMBEDDING_MODEL_NAME
+from app.core.config.settings import settings
 from app.core.db.vector_db import vector_db
+from app.utils.embedding_batcher import EmbeddingBatcher
+from app.utils.semantic_cache import SemanticCache
+
+_TOKENIZER = None
+_MODEL = None
+_DEVICE = "cpu"
+_MODEL_LOCK = threading.Lock()
+
+_EMB_CACHE: "OrderedDict[str, List[float]]" = OrderedDict()
+_EMB_CACHE_LOCK = threading.Lock()
+
+_RESULT_CACHE = SemanticCache(
+    capacity=settings.SEMANTIC_CACHE_SIZE,
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+)
+
+
+def get_embedding_model():
+    """
+    Return the shared (tokenizer, model) pair, loading it on first call
+
+    The model is placed on CUDA in fp16 when a GPU is available.
+    """
+    global _TOKENIZER, _MODEL, _DEVICE
+    if _MODEL is None:
+        with _MODEL_LOCK:
+            if _MODEL is None:
+                import torch
+                from transformers import AutoModel, AutoTokenizer
+
+                if torch.cuda.is_available():
+                    _DEVICE, dtype = "cuda", torch.float16
+                else:
+                    _DEVICE, dtype = "cpu", torch.float32
+                _TOKENIZER = AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME)
+                _MODEL = (
+                    AutoModel.from_pretrained(EMBEDDING_MODEL_NAME, torch_dtype=dtype)
+                    .to(_DEVICE)
+                    .eval()
+                )
+    return _TOKENIZER, _MODEL
+
+
+def encode_texts(texts: List[str]) -> List[List[float]]:
+    """
+    Embed a batch of texts with attention-masked mean pooling, L2-normalized
+    """
+    import torch
+
+    tokenizer, model = get_embedding_model()
+
+    # Tokenize and encode the texts
+    inputs = tokenizer(texts, return_tensors="pt", padding=True, truncation=True).to(
+        _DEVICE
+    )
+    with torch.inference_mode():
+        hidden = model(**inputs).last_hidden_state
+        # Mean pooling over real tokens only, ignoring padding
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        embeddings = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-6)
+        embeddings = torch.nn.functional.normalize(embeddings.float(), dim=-1)
+    return embeddings.cpu().tolist()
+
+
+_BATCHER = EmbeddingBatcher(
+    encode_texts,
+    max_batch=settings.EMB_BATCH_SIZE,
+    max_wait_ms=settings.EMB_BATCH_WAIT_MS,
+)
+
+
+def _emb_cache_key(query: str) -> str:
+    return hashlib.sha256(query.strip().lower().encode("utf-8")).hexdigest()
+
+
+def _emb_cache_get(key: str):
+    with _EMB_CACHE_LOCK:
+        embedding = _EMB_CACHE.get(key)
+        if embedding is not None:
+            _EMB_CACHE.move_to_end(key)
+        return embedding
+
+
+def _emb_cache_put(key: str, embedding: List[float]):
+    with _EMB_CACHE_LOCK:
+        _EMB_CACHE[key] = embedding
+        _EMB_CACHE.move_to_end(key)
+        while len(_EMB_CACHE) > settings.EMB_CACHE_SIZE:
+            _EMB_CACHE.popitem(last=False)
 
 
 class RAGSearchInput(BaseModel):
@@ -21,66 +129,100 @@ class RAGTool(BaseTool):
     description = "Search for relevant Japanese law documents using RAG (Retrieval Augmented Generation)"
     args_schema: Type[BaseModel] = RAGSearchInput
 
+    def _embed(self, query: str) -> List[float]:
+        """
+        Convert the query to an embedding, reusing cached results when enabled
+        """
+        key = None
+        if settings.USE_EMB_CACHE:
+            key = _emb_cache_key(query)
+            cached = _emb_cache_get(key)
+            if cached is not None:
+                return cached
+
+        query_embedding = _BATCHER.embed(query)
+
+        if key is not None:
+            _emb_cache_put(key, query_embedding)
+        return query_embedding
+
+    async def _aembed(self, query: str) -> List[float]:
+        """
+        Async version of _embed; awaits the batched forward pass
+        """
+        key = None
+        if settings.USE_EMB_CACHE:
+            key = _emb_cache_key(query)
+            cached = _emb_cache_get(key)
+            if cached is not None:
+                return cached
+
+        query_embedding = await asyncio.wrap_future(_BATCHER.submit(query))
+
+        if key is not None:
+            _emb_cache_put(key, query_embedding)
+        return query_embedding
+
+    @staticmethod
+    def _format(results: List[Dict[str, Any]]) -> str:
+        formatted_results = []
+        for result in results:
+            formatted_results.append(
+                {
+                    "title": result["title"],
+                    "content": result["content"],  # Truncated at insert time
+                    "category": result["category"],
+                    "date": result["date"],
+                    # COSINE "distances" from Milvus are already similarities
+                    "similarity_score": result["distance"],
+                }
+            )
+
+        return str(formatted_results)
+
     def _run(self, query: str, top_k: int = DEFAULT_TOP_K) -> str:
         """
         Execute the RAG search for Japanese law documents
         """
         try:
-            # In a real implementation, you would convert the query to an embedding
-            # For now, we'll simulate the process
-            import torch
-            from transformers import AutoModel, AutoTokenizer
-
-            # Initialize tokenizer and model for embedding (using a multilingual model)
-            tokenizer = AutoTokenizer.from_pretrained(
-                "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-            )
-            model = AutoModel.from_pretrained(
-                "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-            )
+            query_embedding = self._embed(query)
 
-            # Tokenize and encode the query
-            inputs = tokenizer(
-                query, return_tensors="pt", padding=True, truncation=True
-            )
-            with torch.no_grad():
-                outputs = model(**inputs)
-                # Mean pooling to get sentence embedding
-                query_embedding = (
-                    outputs.last_hidden_state.mean(dim=1).numpy()[0].tolist()
-                )
+            # Reuse results of a near-identical earlier query if possible
+            results = None
+            if settings.USE_SEMANTIC_CACHE:
+                results = _RESULT_CACHE.get(query_embedding, top_k)
 
-            # Search for similar documents in vector DB
-            results = vector_db.search_similar_laws(query_embedding, top_k)
-
-            # Format results
-            formatted_results = []
-            for result in results:
-                formatted_results.append(
-                    {
-                        "title": result["title"],
-                        "content": (
-                            result["content"][:500] + "..."
-                            if len(result["content"]) > 500
-                            else result["content"]
-                        ),  # Truncate long content
-                        "category": result["category"],
-                        "date": result["date"],
-                        "similarity_score": 1
-                        - result["distance"],  # Convert distance to similarity
-                    }
-                )
+            if results is None:
+                # Search for similar documents in vector DB
+                results = vector_db.search_similar_laws(query_embedding, top_k)
+                if settings.USE_SEMANTIC_CACHE:
+                    _RESULT_CACHE.put(query_embedding, top_k, results)
 
-            return str(formatted_results)
+            return self._format(results)
 
         except Exception as e:
             return f"Error during RAG search: {str(e)}"
 
-    def _arun(self, query: str, top_k: int = DEFAULT_TOP_K) -> str:
+    async def _arun(self, query: str, top_k: int = DEFAULT_TOP_K) -> str:
         """
         Async version of the RAG search
         """
-        raise NotImplementedError("RAGTool does not support async")
+        try:
+            query_embedding = await self._aembed(query)
+
+            results = None
+            if settings.USE_SEMANTIC_CACHE:
+                results = _RESULT_CACHE.get(query_embedding, top_k)
+
+            if results is None:
+                results = await vector_db.asearch_similar_laws(query_embedding, top_k)
+                if settings.USE_SEMANTIC_CACHE:
+                    _RESULT_CACHE.put(query_embedding, top_k, results)
+
+            return self._format(results)
+
+        except Exception as e:
+            return f"Error during RAG search: {str(e)}"
 
 
 # Initialize the tool
@@ -22,11 +22,11 @@ class WebSearchTool(BaseTool):
             f"Web search functionality for query '{query}' will be implemented later."
         )
 
-    def _arun(self, query: str) -> str:
+    async def _arun(self, query: str) -> str:
         """
         Async version of the web search
         """
-        raise NotImplementedError("WebSearchTool does not support async")
+        return self._run(query)
 
 
 # Initialize the tool
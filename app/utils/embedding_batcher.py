@@ -0,0 +1,90 @@
+"""
+Micro-batching for embedding requests.
+
+Queries submitted from concurrent requests are collected for up to
+``max_wait_ms`` (or until ``max_batch`` queries are queued) and embedded in a
+single forward pass by a background worker thread. Each caller receives its
+own row of the batch through a future.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Callable, List
+
+
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        encode: Callable[[List[str]], List[List[float]]],
+        max_batch: int = 32,
+        max_wait_ms: float = 15,
+    ):
+        self.encode = encode
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[tuple[str, Future]]" = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(
+                        target=self._loop, name="embedding-batcher", daemon=True
+                    )
+                    self._worker.start()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            # one window per batch, measured from its first query
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                pass
+
+            # drop queries whose caller has already been cancelled
+            batch = [
+                (text, future)
+                for text, future in batch
+                if future.set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = self.encode(texts)
+            except Exception as e:
+                for _, future in batch:
+                    self._deliver(future.set_exception, e)
+                continue
+            for (_, future), embedding in zip(batch, embeddings):
+                self._deliver(future.set_result, embedding)
+
+    @staticmethod
+    def _deliver(setter, value):
+        # a future that cannot take its result must not stop the worker
+        try:
+            setter(value)
+        except InvalidStateError:
+            pass
+
+    def submit(self, text: str) -> Future:
+        """Queue a text for embedding and return a future for its vector"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        """Embed a single text, blocking until its batch has been processed"""
+        return self.submit(text).result()
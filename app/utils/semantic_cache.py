@@ -0,0 +1,70 @@
+"""
+Approximate (semantic) cache for vector search results.
+
+Recent query embeddings are kept in a fixed-size ring buffer together with the
+results Milvus returned for them. A new query whose embedding lies within a
+cosine distance threshold of a cached one reuses those results instead of
+issuing another search.
+"""
+
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+class SemanticCache:
+    def __init__(self, capacity: int, threshold: float):
+        self.capacity = capacity
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._embeddings: Optional[np.ndarray] = None
+        self._results: List[Optional[List[Dict[str, Any]]]] = [None] * capacity
+        self._top_ks: List[int] = [0] * capacity
+        self._size = 0
+        self._next = 0
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def get(
+        self, embedding: List[float], top_k: int
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Return cached results for the nearest cached query, if close enough"""
+        with self._lock:
+            if not self._size:
+                return None
+            vector = self._normalize(embedding)
+            if vector.shape[0] != self._embeddings.shape[1]:
+                return None
+            similarities = self._embeddings[: self._size] @ vector
+            best = int(np.argmax(similarities))
+            if 1 - similarities[best] > self.threshold or self._top_ks[best] < top_k:
+                return None
+            return self._results[best][:top_k]
+
+    def put(self, embedding: List[float], top_k: int, results: List[Dict[str, Any]]):
+        """Store the results of a query, replacing the oldest entry when full"""
+        with self._lock:
+            vector = self._normalize(embedding)
+            if self._embeddings is None or vector.shape[0] != self._embeddings.shape[1]:
+                self._embeddings = np.zeros(
+                    (self.capacity, vector.shape[0]), dtype=np.float32
+                )
+                self._size = 0
+                self._next = 0
+            self._embeddings[self._next] = vector
+            self._results[self._next] = results
+            self._top_ks[self._next] = top_k
+            self._next = (self._next + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+    def clear(self):
+        with self._lock:
+            self._embeddings = None
+            self._results = [None] * self.capacity
+            self._size = 0
+            self._next = 0
@@ -1,16 +1,52 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from loguru import logger
+from openai import AsyncOpenAI
+from sqlalchemy import text
 
+from app.agents.law_agent import http_async_client
 from app.api.v1.api import api_router
 from app.core.config.settings import settings
-from app.core.db.base import engine
+from app.core.db.base import async_engine, engine
+from app.core.db.vector_db import vector_db
 from app.models.conversation import Base  # Import all models to create tables
+from app.tools.rag_tool import encode_texts
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up models and connections so the first request doesn't pay for them"""
+    # Load the Milvus collection into memory
+    await asyncio.to_thread(vector_db.get_collection)
+    # Load the embedding model and run one forward pass to initialize its kernels
+    await asyncio.to_thread(encode_texts, ["warmup"])
+    # Open a pooled database connection
+    async with async_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+    # Open a pooled connection to the LLM API
+    try:
+        await AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY, http_client=http_async_client
+        ).models.list()
+    except Exception as e:
+        logger.warning(f"LLM warm-up failed: {e}")
+
+    yield
+
+    await http_async_client.aclose()
+    await async_engine.dispose()
+
+
 # Create FastAPI app
 app = FastAPI(
-    title=settings.PROJECT_NAME, openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    title=settings.PROJECT_NAME,
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan,
 )
 
 # Include API routes
@@ -1,68 +1,136 @@
-import json
+"""
+Build the retrieval corpus from the law JSON files.
+
+The extractors are plain dict/list walkers with full type annotations so the
+module can be compiled ahead of time with mypyc for a further speedup:
+
+    mypyc spider/corpus_lize.py
+
+which leaves a compiled extension next to this file that Python imports in
+preference to the source.
+"""
+
 import os
 import stat
 from multiprocessing import Pool
 from pathlib import Path
 from traceback import print_exc
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import orjson
+import simdjson
+from tqdm import tqdm  # type: ignore[import-untyped]
+
+__NUM_THREADS__ = os.cpu_count()
+
+# simdjson parsers keep their internal buffers between documents, so each
+# worker process reuses a single one
+__PARSER__: Optional[simdjson.Parser] = None
+
+
+def get_parser() -> simdjson.Parser:
+    global __PARSER__
+    if __PARSER__ is None:
+        __PARSER__ = simdjson.Parser()
+    return __PARSER__
+
+
+def materialize(value):
+    """Convert a simdjson proxy into plain Python objects.
 
-from tqdm import tqdm
+    Keys are left as decoded rather than passed through ``sys.intern``: the
+    extra pass that rebuilds every dict costs far more than the cheap
+    hash+memcmp it would save on the short key names looked up below.
+    """
+    if isinstance(value, simdjson.Object):
+        return value.as_dict()
+    if isinstance(value, simdjson.Array):
+        return value.as_list()
+    return value
 
-__NUM_THREADS__ = 7
 
+# Only these parts of LawBody are read on the main path; the rest (TOC,
+# appendix tables, ...) is never decoded into Python objects
+__USED_BODY_KEYS__ = ("LawTitle", "MainProvision", "SupplProvision")
 
-def extract_all_text_fields(obj, text_list=None) -> List[str]:
-    """Recursively extract all #text fields from the JSON structure."""
+
+def extract_all_text_fields(obj: Any, text_list: Optional[List[str]] = None) -> List[str]:
+    """Extract all #text fields from the JSON structure in document order."""
     if text_list is None:
         text_list = []
 
-    if isinstance(obj, dict):
-        for key, value in obj.items():
-            if key == "#text" and isinstance(value, str) and value.strip():
-                text_list.append(value.strip())
-            else:
-                extract_all_text_fields(value, text_list)
-    elif isinstance(obj, list):
-        for item in obj:
-            extract_all_text_fields(item, text_list)
+    # Explicit worklist instead of recursion; children are pushed in reverse so
+    # they are popped in document order. Only extracted texts are pushed as str.
+    stack: List[Any] = [obj] if type(obj) in (dict, list) else []
+    while stack:
+        o = stack.pop()
+        t = type(o)
+        if t is str:
+            text_list.append(o)
+        elif t is dict:
+            pending: List[Any] = []
+            for key, value in o.items():
+                tv = type(value)
+                if key == "#text" and tv is str:
+                    value = value.strip()
+                    if value:
+                        pending.append(value)
+                elif tv is dict or tv is list:
+                    pending.append(value)
+            stack.extend(reversed(pending))
+        else:
+            stack.extend(
+                reversed([i for i in o if type(i) is dict or type(i) is list])
+            )
 
     return text_list
 
 
-def extract_text_from_sentence(sentence_obj) -> str:
-    """Extract text from Sentence object in various formats."""
+def _collect_sentence(sentence_obj: Any, texts: List[str]) -> None:
+    """Append the non-empty text pieces of a Sentence object to texts."""
     if isinstance(sentence_obj, dict):
         if "#text" in sentence_obj:
-            return sentence_obj["#text"] or ""
+            text = sentence_obj["#text"]
+            if text:
+                texts.append(text)
         elif "Sentence" in sentence_obj:
-            return extract_text_from_sentence(sentence_obj["Sentence"])
+            _collect_sentence(sentence_obj["Sentence"], texts)
         else:
-            # Handle different possible structures
+            # Handle different possible structures: the first value with any
+            # text is the whole result
             for key, value in sentence_obj.items():
                 if isinstance(value, str):
-                    return value
+                    if value:
+                        texts.append(value)
+                    return
                 elif isinstance(value, (dict, list)):
-                    result = extract_text_from_sentence(value)
-                    if result:
-                        return result
+                    found = len(texts)
+                    _collect_sentence(value, texts)
+                    if len(texts) > found:
+                        return
     elif isinstance(sentence_obj, list):
-        texts = []
         for item in sentence_obj:
-            text = extract_text_from_sentence(item)
-            if text:
-                texts.append(text)
-        return " ".join(texts)
+            _collect_sentence(item, texts)
     elif isinstance(sentence_obj, str):
-        return sentence_obj
-    return ""
+        if sentence_obj:
+            texts.append(sentence_obj)
 
 
-def extract_table_content(table_obj) -> str:
+def extract_text_from_sentence(sentence_obj: Any) -> str:
+    """Extract text from Sentence object in various formats."""
+    # Pieces are collected into one list and joined once here instead of at
+    # every nesting level
+    texts: List[str] = []
+    _collect_sentence(sentence_obj, texts)
+    return " ".join(texts)
+
+
+def extract_table_content(table_obj: Any) -> str:
     """Convert table structure to markdown format."""
     if not table_obj:
         return ""
 
-    markdown_table = []
+    markdown_table: List[str] = []
 
     # Handle both single table and list of tables
     if isinstance(table_obj, list):
@@ -90,7 +158,7 @@ def extract_table_content(table_obj) -> str:
         for row in rows:
             if "TableColumn" in row:
                 columns = row["TableColumn"]
-                row_texts = []
+                row_texts: List[str] = []
 
                 # Handle column that might be a single dict or a list of dicts
                 if isinstance(columns, list):
@@ -110,86 +178,124 @@ def extract_table_content(table_obj) -> str:
     return "\n".join(markdown_table)
 
 
-def process_paragraph_content(paragraph_obj) -> str:
-    """Process paragraph content recursively."""
-    content_parts = []
-
-    if isinstance(paragraph_obj, dict):
-        # Check for direct text
-        if "ParagraphSentence" in paragraph_obj:
-            text = extract_text_from_sentence(paragraph_obj["ParagraphSentence"])
-            if text:
-                content_parts.append(text)
-
-        # Check for lists
-        if "List" in paragraph_obj:
-            list_obj = paragraph_obj["List"]
-            # Handle both single list item and list of items
-            if isinstance(list_obj, dict):
-                # Single list item
-                if "ListSentence" in list_obj:
-                    list_text = extract_text_from_sentence(list_obj["ListSentence"])
-                    if list_text:
-                        content_parts.append(f"- {list_text}")
-            elif isinstance(list_obj, list):
-                # Multiple list items
-                for list_item in list_obj:
-                    if isinstance(list_item, dict) and "ListSentence" in list_item:
-                        list_text = extract_text_from_sentence(
-                            list_item["ListSentence"]
-                        )
-                        if list_text:
-                            content_parts.append(f"- {list_text}")
-            else:
-                # Direct handling if ListSentence is directly in the list object
-                list_text = extract_text_from_sentence(list_obj)
+def _sentence_texts(sentence_obj: Any) -> List[str]:
+    """Text of a paragraph's ParagraphSentence."""
+    text = extract_text_from_sentence(sentence_obj)
+    return [text] if text else []
+
+
+def _list_texts(list_obj: Any) -> List[str]:
+    """Bullet lines of a paragraph's List."""
+    content_parts: List[str] = []
+    # Handle both single list item and list of items
+    if isinstance(list_obj, dict):
+        # Single list item
+        if "ListSentence" in list_obj:
+            list_text = extract_text_from_sentence(list_obj["ListSentence"])
+            if list_text:
+                content_parts.append(f"- {list_text}")
+    elif isinstance(list_obj, list):
+        # Multiple list items
+        for list_item in list_obj:
+            if isinstance(list_item, dict) and "ListSentence" in list_item:
+                list_text = extract_text_from_sentence(list_item["ListSentence"])
                 if list_text:
                     content_parts.append(f"- {list_text}")
+    else:
+        # Direct handling if ListSentence is directly in the list object
+        list_text = extract_text_from_sentence(list_obj)
+        if list_text:
+            content_parts.append(f"- {list_text}")
+    return content_parts
+
+
+def _table_texts(table_struct: Any) -> List[str]:
+    """Markdown tables of a paragraph's TableStruct (single or list)."""
+    content_parts: List[str] = []
+    for table_entry in table_struct if isinstance(table_struct, list) else [table_struct]:
+        table_content = extract_table_content(table_entry)
+        if table_content:
+            content_parts.append(table_content)
+    return content_parts
+
+
+# Paragraph keys with their own handler, mapped to the slot that fixes their
+# output order (sentence, list, table) regardless of key order in the dict
+__PARAGRAPH_HANDLERS__: Dict[str, Tuple[int, Callable[[Any], List[str]]]] = {
+    "ParagraphSentence": (0, _sentence_texts),
+    "List": (1, _list_texts),
+    "TableStruct": (2, _table_texts),
+}
+
+# Paragraph keys that carry no nested content
+__PARAGRAPH_SKIP_KEYS__ = frozenset(("ParagraphNum", "@Hide", "@Num", "@OldStyle", "@OldNum"))
+
+
+def process_paragraph_content(paragraph_obj: Any) -> str:
+    """Process paragraph content, including nested sub-structures."""
+    content_parts: List[str] = []
+
+    # Explicit worklist instead of recursion. Joining every non-empty part once
+    # at the end gives the same text as joining at each nesting level. Parts
+    # are pushed as str, containers still to be expanded as dict/list.
+    stack: List[Any] = [paragraph_obj] if type(paragraph_obj) in (dict, list) else []
+    while stack:
+        o = stack.pop()
+        t = type(o)
+        if t is str:
+            content_parts.append(o)
+        elif t is dict:
+            # One pass over the keys: handled parts go to their slot, other
+            # containers are recursed into after them
+            slots: List[List[str]] = [[], [], []]
+            children: List[Any] = []
+            for key, value in o.items():
+                handler = __PARAGRAPH_HANDLERS__.get(key)
+                if handler is not None:
+                    slots[handler[0]] = handler[1](value)
+                elif key not in __PARAGRAPH_SKIP_KEYS__ and (
+                    type(value) is dict or type(value) is list
+                ):
+                    children.append(value)
+            stack.extend(reversed(children))
+            for texts in reversed(slots):
+                stack.extend(reversed(texts))
+        elif t is list:
+            stack.extend(
+                reversed([i for i in o if type(i) is dict or type(i) is list])
+            )
 
-        # Check for tables - now handling both single table struct and list of table structs
-        if "TableStruct" in paragraph_obj:
-            table_struct = paragraph_obj["TableStruct"]
-            if isinstance(table_struct, list):
-                # Multiple table structures
-                for table_entry in table_struct:
-                    table_content = extract_table_content(table_entry)
-                    if table_content:
-                        content_parts.append(table_content)
-            else:
-                # Single table structure
-                table_content = extract_table_content(table_struct)
-                if table_content:
-                    content_parts.append(table_content)
-
-        # Recursively check other fields
-        for key, value in paragraph_obj.items():
-            if key not in [
-                "ParagraphSentence",
-                "List",
-                "TableStruct",
-                "ParagraphNum",
-                "@Hide",
-                "@Num",
-                "@OldStyle",
-                "@OldNum",
-            ]:
-                if isinstance(value, (dict, list)):
-                    sub_content = process_paragraph_content(value)
-                    if sub_content:
-                        content_parts.append(sub_content)
-
-    elif isinstance(paragraph_obj, list):
-        for item in paragraph_obj:
-            sub_content = process_paragraph_content(item)
-            if sub_content:
-                content_parts.append(sub_content)
+    return " ".join(content_parts)
+
+
+# Paragraph keys of the common flat shape: only sentence/list/table content
+# plus attributes, with no nested items to walk
+__FLAT_PARAGRAPH_KEYS__ = __PARAGRAPH_SKIP_KEYS__.union(__PARAGRAPH_HANDLERS__)
 
+# Article keys handled directly by process_article
+__ARTICLE_SKIP_KEYS__ = frozenset(("ArticleTitle", "Paragraph", "@Delete", "@Hide", "@Num"))
+
+
+def _process_paragraph(paragraph_obj: Any) -> str:
+    """Process a paragraph, reading the flat e-LAWS shape directly."""
+    if type(paragraph_obj) is not dict or not (
+        paragraph_obj.keys() <= __FLAT_PARAGRAPH_KEYS__
+    ):
+        return process_paragraph_content(paragraph_obj)
+
+    content_parts: List[str] = []
+    if "ParagraphSentence" in paragraph_obj:
+        content_parts.extend(_sentence_texts(paragraph_obj["ParagraphSentence"]))
+    if "List" in paragraph_obj:
+        content_parts.extend(_list_texts(paragraph_obj["List"]))
+    if "TableStruct" in paragraph_obj:
+        content_parts.extend(_table_texts(paragraph_obj["TableStruct"]))
     return " ".join(content_parts)
 
 
-def process_article(article_obj) -> str:
+def process_article(article_obj: Dict[str, Any]) -> str:
     """Process an article and its paragraphs."""
-    article_parts = []
+    article_parts: List[str] = []
 
     # Always include the article title
     if "ArticleTitle" in article_obj:
@@ -197,19 +303,14 @@ def process_article(article_obj) -> str:
 
     if "Paragraph" in article_obj:
         paragraphs = article_obj["Paragraph"]
-        if isinstance(paragraphs, list):
-            for para in paragraphs:
-                content = process_paragraph_content(para)
-                if content:
-                    article_parts.append(content)
-        else:
-            content = process_paragraph_content(paragraphs)
+        for para in paragraphs if type(paragraphs) is list else (paragraphs,):
+            content = _process_paragraph(para)
             if content:
                 article_parts.append(content)
 
     # Handle any additional content directly in the article
     for key, value in article_obj.items():
-        if key not in ["ArticleTitle", "Paragraph", "@Delete", "@Hide", "@Num"]:
+        if key not in __ARTICLE_SKIP_KEYS__:
             if isinstance(value, (dict, list)):
                 extra_content = process_paragraph_content(value)
                 if extra_content:
@@ -320,20 +421,41 @@ def process_supplementary_provision(prov, prov_idx, main_title) -> List[Dict[str
     return entries
 
 
-def transform_law_json_to_articles(file_path: str) -> List[Dict[str, Any]]:
+def load_law(data: bytes) -> Dict[str, Any]:
+    """Parse a law JSON document and materialize the parts of "Law" used below.
+
+    Only plain Python objects are returned; the simdjson proxies stay local
+    to this call, so the shared parser can be reused afterwards.
+    """
+    doc: Any = get_parser().parse(data)
+    law: Dict[str, Any] = {}
+    if "Law" in doc:
+        law_proxy = doc["Law"]
+        law = {k: materialize(v) for k, v in law_proxy.items() if k != "LawBody"}
+        if "LawBody" in law_proxy:
+            body_proxy = law_proxy["LawBody"]
+            law["LawBody"] = {
+                k: materialize(body_proxy[k])
+                for k in __USED_BODY_KEYS__
+                if k in body_proxy
+            }
+    return law
+
+
+def transform_law_json_to_articles(
+    file_path: str,
+) -> Union[List[Dict[str, Any]], Exception]:
     """Transform a single law JSON file to multiple corpus entries, one per article."""
     try:
         if isinstance(file_path, tuple):
             file_path = file_path[0]
-        with open(file_path, "r", encoding="utf-8") as f:
-            law_data = json.load(f)
-
-        law = law_data.get("Law", {})
+        data = Path(file_path).read_bytes()
+        law = load_law(data)
 
         # Extract main title
         main_title = extract_title(law)
 
-        corpus_entries = []
+        corpus_entries: List[Dict[str, Any]] = []
 
         # Process main provision articles
         if "MainProvision" in law.get("LawBody", {}):
@@ -384,7 +506,9 @@ def transform_law_json_to_articles(file_path: str) -> List[Dict[str, Any]]:
         # If no articles were found, create a single entry with all content
         if not corpus_entries:
             # Extract ALL #text fields from the entire JSON structure
-            all_text_fields = extract_all_text_fields(law_data)
+            all_text_fields = extract_all_text_fields(
+                materialize(get_parser().parse(data))
+            )
             full_text = "\n".join(all_text_fields)
 
             if not full_text:
@@ -401,38 +525,33 @@ def transform_law_json_to_articles(file_path: str) -> List[Dict[str, Any]]:
         return corpus_entries
     except Exception as e:
         print_exc()
-        return e
+        # The traceback would keep proxies of the reused parser alive while
+        # the pool holds on to this result, failing the rest of the chunk
+        return e.with_traceback(None)
 
 
 def process_directory(input_dir: Path, output_file: Path):
     """Process all JSON files in directory and create corpus file."""
-    corpus_list = []
     idx_counter = 0
 
-    # Get all JSON files in directory
-    json_files = list(input_dir.glob("*.json"))
+    # Get all JSON files in directory; scandir entries carry the file type, so
+    # no extra stat is needed per file
+    with os.scandir(input_dir) as it:
+        json_files = [
+            entry.path
+            for entry in it
+            if entry.name.endswith(".json") and entry.is_file()
+        ]
 
     total = len(json_files)
 
-    # for idx, filename in enumerate(json_files, 1):
-    #     file_path = os.path.join(input_dir, filename)
-    #     try:
-    #         entries = transform_law_json_to_articles(file_path)
-    #         # Update the idx for each entry to be globally unique
-    #         for entry in entries:
-    #             entry["idx"] = idx_counter
-    #             idx_counter += 1
-    #             corpus_list.append(entry)
-    #         print(f"Processed [{idx}:{total}]: {filename} -> {len(entries)} entries")
-    #     except Exception as e:
-    #         print_exc()
-    #         raise e
-    #         print(f"Error processing {filename}: {str(e)}")
-
     pool = Pool(processes=__NUM_THREADS__)
-    results = pool.imap(
+    # Files are independent, so take results in completion order; idx is still
+    # assigned here to keep it globally unique
+    results = pool.imap_unordered(
         transform_law_json_to_articles,
         json_files,
+        chunksize=8,
     )
     static_dict = {
         "pass": 0,
@@ -440,24 +559,27 @@ def process_directory(input_dir: Path, output_file: Path):
         "return": 0,
         "counts": 0,
     }
-    loop = tqdm(results, total=total, desc="Processing")
-    for entries in loop:
-        static_dict["return"] += 1
-        if isinstance(entries, list):
-            for entry in entries:
-                entry["idx"] = idx_counter
-                idx_counter += 1
-                static_dict["counts"] += 1
-                corpus_list.append(entry)
-            static_dict["pass"] += 1
-        else:
-            static_dict["fail"] += 1
-
-    # Write to output file
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(corpus_list, f, ensure_ascii=False, indent=2)
+    # Entries are written as soon as their file is processed, so the corpus is
+    # never held in memory as a whole
+    with open(output_file, "wb") as f:
+        f.write(b"[\n")
+        loop = tqdm(results, total=total, desc="Processing")
+        for entries in loop:
+            static_dict["return"] += 1
+            if isinstance(entries, list):
+                for entry in entries:
+                    if idx_counter:
+                        f.write(b",\n")
+                    entry["idx"] = idx_counter
+                    idx_counter += 1
+                    static_dict["counts"] += 1
+                    f.write(orjson.dumps(entry, option=orjson.OPT_INDENT_2))
+                static_dict["pass"] += 1
+            else:
+                static_dict["fail"] += 1
+        f.write(b"\n]")
 
-    print(f"Created corpus with {len(corpus_list)} entries in {output_file}")
+    print(f"Created corpus with {idx_counter} entries in {output_file}")
 
 
 # Example usage
@@ -1,118 +1,182 @@
+import asyncio
+import io
+from collections import deque
 from threading import Thread
 from wsgiref import headers
 import httpx
 import pandas as pd
-import xml.etree.ElementTree as ET
-from bs4 import BeautifulSoup
+from lxml import etree, html
 import re
 from pathlib import Path
 from tqdm import tqdm
-from multiprocessing import Pool
-from multiprocessing.pool import ThreadPool
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse, parse_qs
-from itertools import repeat
 from traceback import print_exc
-from time import sleep
 
 __THREAD_NUM__ = 7
 
+# entries submitted to the parsing threads but not yet collected
+__MAX_PENDING_ENTRIES__ = 2 * __THREAD_NUM__
+
+# concurrent downloads in flight on the shared async client
+__CONCURRENCY__ = 32
+
 __DOWNLOAD_URL__ = "https://legaldoc.jp/res/hanrei/%s"
 
-__CHUNK_SIZE__ = 1024 * 64
+__CHUNK_SIZE__ = 1024 * 1024
+
+__RECORD_COLUMNS__ = [
+    "start_index",
+    "case_title",
+    "court_type",
+    "court_name",
+    "judgment_date",
+    "case_number",
+    "detail_url",
+    "pdf_url",
+]
+
+__CATEGORY_COLUMNS__ = ("court_type", "court_name", "judgment_date")
+
+__LIMITS__ = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+
+__TIMEOUT__ = httpx.Timeout(30.0, connect=10.0)
 
 
 def parse_multiple_entries_xml(xml_content):
-    # Parse the XML content
-    root = ET.fromstring(xml_content)
+    return parse_entries(io.BytesIO(xml_content.encode("utf-8")))
 
-    # Find all entry tags that contain partial-response
-    entries = root.findall(".//entry")
 
-    all_data_list = []
+def iter_entries(source):
+    """Stream the entry tags of the export as (start, CDATA table) pairs."""
+    for _, entry in etree.iterparse(source, tag="entry", huge_tree=True):
+        update_element = entry.find('.//update[@id="j_idt209-courtsDataTable"]')
+        yield (
+            entry.get("start", "0"),
+            update_element.text if update_element is not None else None,
+        )
+
+        # Drop the finished entry and everything parsed before it, so only one
+        # entry is held in memory at a time
+        entry.clear()
+        while entry.getprevious() is not None:
+            del entry.getparent()[0]
 
-    pool = Pool(__THREAD_NUM__)
 
-    results = pool.imap(_parse_multiple_entries_xml, entries)
+def parse_entries(source):
+    """Parse the export from a file path or binary file object into a DataFrame."""
+    all_data_list = []
 
-    for result in tqdm(results, desc="Parsing entries", total=len(entries)):
-        all_data_list.extend(result)
+    # Entries are handed to the workers while the file is still being parsed;
+    # only the strings are passed so no element trees are shared between
+    # threads. lxml parses with the GIL released, so threads parallelize
+    # without the pickling a process pool needs. At most __MAX_PENDING_ENTRIES__
+    # entries wait in the executor: the oldest is drained before the next is
+    # submitted, so the export is never queued whole
+    with ThreadPoolExecutor(__THREAD_NUM__) as executor, tqdm(
+        desc="Parsing entries"
+    ) as progress:
+        pending = deque()
+        for start_value, cdata_section in iter_entries(source):
+            if len(pending) >= __MAX_PENDING_ENTRIES__:
+                all_data_list.extend(pending.popleft().result())
+                progress.update()
+            pending.append(
+                executor.submit(
+                    _parse_multiple_entries_xml, start_value, cdata_section
+                )
+            )
+        while pending:
+            all_data_list.extend(pending.popleft().result())
+            progress.update()
 
-    # Create DataFrame
-    df = pd.DataFrame(all_data_list)
+    # Create DataFrame; court and date values repeat across many cases, so
+    # they are stored as categories
+    df = pd.DataFrame.from_records(all_data_list, columns=__RECORD_COLUMNS__)
+    for column in __CATEGORY_COLUMNS__:
+        df[column] = df[column].astype("category")
 
     return df
 
 
-def _parse_multiple_entries_xml(entry):
+def _find_by_class(element, tag, class_name):
+    """Descendants of element with the given tag that carry class_name."""
+    return [
+        e
+        for e in element.iterdescendants(tag)
+        if class_name in (e.get("class") or "").split()
+    ]
+
+
+def _text(element, strip=False):
+    """Text of all descendant text nodes, like BeautifulSoup's get_text."""
+    texts = element.xpath(".//text()")
+    if strip:
+        return "".join(t.strip() for t in texts if t.strip())
+    return "".join(texts)
+
+
+def _parse_multiple_entries_xml(start_value, cdata_section):
     """
-    Parse multiple entry tags in the XML and extract information into a pandas DataFrame
+    Parse the court table of one entry into records
 
     Args:
-        xml_content (str): The XML content as string
+        start_value (str): The start attribute of the entry
+        cdata_section (str): The HTML table from the entry's CDATA section
 
     Returns:
-        pd.DataFrame: DataFrame containing extracted court case information from all entries
+        list: Records with the extracted court case information
     """
 
-    # Get the start attribute for this entry
-    start_value = entry.get("start", "0")
-
-    # Find the CDATA section which contains HTML table within this entry
-    update_element = entry.find('.//update[@id="j_idt209-courtsDataTable"]')
-
     records = []
 
-    if update_element is not None:
-        cdata_section = update_element.text
-        soup = BeautifulSoup(cdata_section, "html.parser")
+    if cdata_section:
+        table = html.fragment_fromstring(cdata_section, create_parent="div")
 
         # Extract data from the table
-        rows = soup.find_all("tr")[1:]  # Skip header row
+        rows = list(table.iterdescendants("tr"))[1:]  # Skip header row
 
         for row in rows:
-            cells = row.find_all(["td"])
+            cells = list(row.iterdescendants("td"))
 
             if len(cells) >= 4:  # Ensure we have enough cells
                 # Extract court type badge
-                court_type_badge = (
-                    cells[0].find("span", class_="badge") if cells[0] else None
-                )
+                court_type_badges = _find_by_class(cells[0], "span", "badge")
                 court_type_class = (
-                    court_type_badge.get("class")[2] if court_type_badge else ""
+                    court_type_badges[0].get("class").split()[2]
+                    if court_type_badges
+                    else ""
                 )
 
                 # Extract case details from second cell
-                case_link = cells[1].find("a", class_="link-pdf") if cells[1] else None
-                case_title = case_link.text.strip() if case_link else ""
+                case_links = _find_by_class(cells[1], "a", "link-pdf")
+                case_link = case_links[0] if case_links else None
+                case_title = _text(case_link).strip() if case_link is not None else ""
 
                 # Extract court info
-                items_divs = cells[1].find_all("div", class_="items")
+                items_divs = _find_by_class(cells[1], "div", "items")
                 court_info = {}
-                if items_divs:
-                    for item_div in items_divs:
-                        divs = item_div.find_all("div")
-                        for div in divs:
-                            text = div.get_text()
-                            if "裁判所" in text:  # Court
-                                court_info["court"] = (
-                                    text.split("：")[1].strip() if "：" in text else ""
-                                )
-                            elif "裁判日" in text:  # Judgment date
-                                court_info["judgment_date"] = (
-                                    text.split("：")[1].strip() if "：" in text else ""
-                                )
+                for item_div in items_divs:
+                    for div in item_div.iterdescendants("div"):
+                        text = _text(div)
+                        if "裁判所" in text:  # Court
+                            court_info["court"] = (
+                                text.split("：")[1].strip() if "：" in text else ""
+                            )
+                        elif "裁判日" in text:  # Judgment date
+                            court_info["judgment_date"] = (
+                                text.split("：")[1].strip() if "：" in text else ""
+                            )
 
                 # Extract case number from third cell
-                case_number = cells[2].get_text(strip=True) if cells[2] else ""
+                case_number = _text(cells[2], strip=True)
 
                 # Extract additional info from fourth cell (visible on small screens)
-                case_outline = cells[3]
                 event_number_alt = ""
-                if case_outline:
-                    for div in case_outline.find_all("div"):
-                        text = div.get_text()
-                        if "事件番号" in text and "：" in text:
-                            event_number_alt = text.split("：")[1].strip()
+                for div in cells[3].iterdescendants("div"):
+                    text = _text(div)
+                    if "事件番号" in text and "：" in text:
+                        event_number_alt = text.split("：")[1].strip()
 
                 # Use case number from third cell primarily, fallback to one from fourth cell
                 final_case_number = case_number or event_number_alt
@@ -125,12 +189,8 @@ def _parse_multiple_entries_xml(entry):
                     "court_name": court_info.get("court", ""),
                     "judgment_date": court_info.get("judgment_date", ""),
                     "case_number": final_case_number,
-                    "detail_url": case_link.get("href") if case_link else "",
-                    "pdf_url": (
-                        cells[1].find("a", class_="link-pdf").get("href")
-                        if cells[1] and cells[1].find("a", class_="link-pdf")
-                        else ""
-                    ),
+                    "detail_url": case_link.get("href") if case_link is not None else "",
+                    "pdf_url": case_link.get("href") if case_link is not None else "",
                 }
                 records.append(record)
 
@@ -155,10 +215,7 @@ def read_court_cases_file(file_path):
     Returns:
         pd.DataFrame: DataFrame containing extracted court case information
     """
-    with open(file_path, "r", encoding="utf-8") as f:
-        xml_content = f.read()
-
-    return parse_multiple_entries_xml(xml_content)
+    return parse_entries(str(file_path))
 
 
 def parse_court_cases_from_entries(file_path_or_content, is_file=True):
@@ -173,12 +230,9 @@ def parse_court_cases_from_entries(file_path_or_content, is_file=True):
         pd.DataFrame: DataFrame containing extracted court case information from all entries
     """
     if is_file:
-        with open(file_path_or_content, "r", encoding="utf-8") as f:
-            xml_content = f.read()
-    else:
-        xml_content = file_path_or_content
+        return parse_entries(str(file_path_or_content))
 
-    return parse_multiple_entries_xml(xml_content)
+    return parse_multiple_entries_xml(file_path_or_content)
 
 
 def extract_filename_from_url(url):
@@ -196,35 +250,82 @@ def extract_filename_from_url(url):
     return None
 
 
-def downloader(args):
-    client, filename, dir = args
-    try:
-        url = __DOWNLOAD_URL__ % filename
-        file_path = dir / filename
-        tmp_path = dir / f"{filename}.tmp"
-        if file_path.is_file():
+async def downloader(client, filename, dir, sem):
+    async with sem:
+        try:
+            url = __DOWNLOAD_URL__ % filename
+            file_path = dir / filename
+            tmp_path = dir / f"{filename}.tmp"
+            if file_path.is_file():
+                return file_path
+            # Resume a partial download left by an earlier run
+            offset = tmp_path.stat().st_size if tmp_path.is_file() else 0
+            range_headers = {"Range": f"bytes={offset}-"} if offset else None
+
+            async with client.stream(
+                "GET",
+                url,
+                headers=range_headers,
+            ) as resp:
+                # 416: the partial file already holds the whole document
+                if resp.status_code != 416:
+                    # Keep the partial file for the next run on any other error
+                    if resp.status_code not in (200, 206):
+                        raise Exception(
+                            f"Failed to download file: {resp.status_code}"
+                        )
+                    with open(
+                        tmp_path,
+                        # Servers that ignore Range answer 200 with the full body
+                        "ab" if resp.status_code == 206 else "wb",
+                        buffering=__CHUNK_SIZE__,
+                    ) as f:
+                        async for chunk in resp.aiter_bytes(__CHUNK_SIZE__):
+                            f.write(chunk)
+
+                tmp_path.rename(file_path)
+            # be polite to the server: each slot pauses before the next file
+            await asyncio.sleep(1)
             return file_path
-        if tmp_path.is_file():
-            tmp_path.unlink()
-
-        with client.stream(
-            "GET",
-            url,
-        ) as resp:
-            with open(
-                tmp_path,
-                "wb",
-            ) as f:
-                for chunk in resp.iter_bytes(__CHUNK_SIZE__):
-                    f.write(chunk)
-                f.flush()
-
-            tmp_path.rename(file_path)
-        sleep(1)
-        return file_path
-    except Exception as e:
-        # print_exc()
-        return e
+        except Exception as e:
+            # print_exc()
+            return e
+
+
+async def download_all(file_names, document_dir):
+    sem = asyncio.Semaphore(__CONCURRENCY__)
+    async with httpx.AsyncClient(
+        headers={
+            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.90 Safari/537.36",
+        },
+        # http2/limits/retries live on the transport, which overrides the
+        # client-level ones when given
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            limits=__LIMITS__,
+            retries=3,
+            proxy="socks5://127.0.0.1:7890",
+        ),
+        timeout=__TIMEOUT__,
+    ) as client:
+        tasks = [
+            downloader(client, filename, document_dir, sem) for filename in file_names
+        ]
+
+        loop = tqdm(
+            asyncio.as_completed(tasks), desc="Downloading...", total=len(tasks)
+        )
+        status_dict = {"success": 0, "failed": 0, "last_error": ""}
+        for task in loop:
+            result = await task
+            if isinstance(result, Path):
+                status_dict["success"] += 1
+            else:
+                status_dict["failed"] += 1
+                status_dict["last_error"] = str(result)
+            loop.set_postfix(status_dict)
+
+    return status_dict
 
 
 # Example usage:
@@ -234,48 +335,23 @@ if __name__ == "__main__":
     examples_dir = ROOT / "examples"
     document_dir = examples_dir / "documents"
     xml_file = examples_dir / "legal_export_n3356_1768705367915.xml"
-    csv_file = examples_dir / "legal_export_n3356_1768705367915.csv"
+    parquet_file = examples_dir / "legal_export_n3356_1768705367915.parquet"
 
     examples_dir.mkdir(parents=True, exist_ok=True)
     document_dir.mkdir(parents=True, exist_ok=True)
 
     df = None
-    if not csv_file.is_file():
+    if not parquet_file.is_file():
         df = read_court_cases_file(xml_file)
         df["file_name"] = df["pdf_url"].apply(extract_filename_from_url)
-        # Save to CSV
-        df.to_csv(csv_file, index=False)
+        # Save to Parquet, which keeps the category columns dictionary encoded
+        df.to_parquet(parquet_file, index=False)
     else:
-        df = pd.read_csv(csv_file)
-
-    with httpx.Client(
-        headers={
-            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.90 Safari/537.36",
-        },
-        proxy="socks5://127.0.0.1:7890",
-    ) as client:
-        pool = ThreadPool(__THREAD_NUM__)
-
-        results = pool.imap(
-            downloader,
-            zip(
-                repeat(client),
-                df["file_name"].tolist(),
-                repeat(document_dir),
-            ),
-        )
+        df = pd.read_parquet(parquet_file)
 
-        loop = tqdm(results, desc="Downloading...", total=len(df))
-        status_dict = {"success": 0, "failed": 0, "last_error": ""}
-        for result in loop:
-            if isinstance(result, Path):
-                status_dict["success"] += 1
-            else:
-                status_dict["failed"] += 1
-                status_dict["last_error"] = str(result)
-            loop.set_postfix(status_dict)
+    status_dict = asyncio.run(download_all(df["file_name"].tolist(), document_dir))
 
-        if status_dict["failed"]:
-            exit(1)
-        else:
-            exit(0)
+    if status_dict["failed"]:
+        exit(1)
+    else:
+        exit(0)
@@ -1,14 +1,18 @@
+import asyncio
 from pathlib import Path
 import httpx
-from multiprocessing.pool import ThreadPool
 import json
-import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from loguru import logger
 from traceback import print_exc
-from itertools import repeat
 from tqdm import tqdm
 
-__CHUNK_SIZE__ = 1024 * 64
+__CHUNK_SIZE__ = 1024 * 1024
+
+__LIMITS__ = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+
+__TIMEOUT__ = httpx.Timeout(30.0, connect=10.0)
 
 search_url = "https://rmfyalk.court.gov.cn/cpws_al_api/api/cpwsAl/search"
 download_url = "https://rmfyalk.court.gov.cn/cpws_al_api/api/cpwsAl/contentDownload?id="
@@ -16,35 +20,132 @@ download_url = "https://rmfyalk.court.gov.cn/cpws_al_api/api/cpwsAl/contentDownl
 # COOKIES = httpx.Cookies()
 
 
-def downloader(args):
-    client, data, dir = args
-    try:
-        id = data["id"]
-        url = download_url + id
-        file_path = dir / f"{id}.pdf"
-        tmp_path = dir / f"{id}.pdf.tmp"
-        if file_path.is_file():
+async def downloader(client, data, dir, sem):
+    async with sem:
+        try:
+            id = data["id"]
+            url = download_url + id
+            file_path = dir / f"{id}.pdf"
+            tmp_path = dir / f"{id}.pdf.tmp"
+            if file_path.is_file():
+                return file_path
+            # Resume a partial download left by an earlier run
+            offset = tmp_path.stat().st_size if tmp_path.is_file() else 0
+            range_headers = {"Range": f"bytes={offset}-"} if offset else None
+
+            async with client.stream(
+                "GET",
+                url,
+                headers=range_headers,
+            ) as resp:
+                # 416: the partial file already holds the whole document
+                if resp.status_code != 416:
+                    # Keep the partial file for the next run on any other error
+                    if resp.status_code not in (200, 206):
+                        raise Exception(
+                            f"Failed to download file: {resp.status_code}"
+                        )
+                    with open(
+                        tmp_path,
+                        # Servers that ignore Range answer 200 with the full body
+                        "ab" if resp.status_code == 206 else "wb",
+                        buffering=__CHUNK_SIZE__,
+                    ) as f:
+                        async for chunk in resp.aiter_bytes(__CHUNK_SIZE__):
+                            f.write(chunk)
+
+                tmp_path.rename(file_path)
             return file_path
-        if tmp_path.is_file():
-            tmp_path.unlink()
-
-        with client.stream(
-            "GET",
-            url,
-        ) as resp:
-            with open(
-                tmp_path,
-                "wb",
-            ) as f:
-                for chunk in resp.iter_bytes(__CHUNK_SIZE__):
-                    f.write(chunk)
-                f.flush()
-
-            tmp_path.rename(file_path)
-        return file_path
-    except Exception as e:
-        print_exc()
-        return e
+        except Exception as e:
+            print_exc()
+            return e
+
+
+def to_table(rows):
+    """Arrow table of the index rows for CSV export."""
+    # Columns are the union of all rows' keys (from_pylist would only look at
+    # the first row); nested values are stored as JSON since CSV can't hold them
+    columns = {}
+    for row in rows:
+        for key in row:
+            columns.setdefault(key, [])
+    for row in rows:
+        for key, values in columns.items():
+            value = row.get(key)
+            if isinstance(value, (dict, list)):
+                value = json.dumps(value, ensure_ascii=False)
+            values.append(value)
+    return pa.Table.from_pydict(columns)
+
+
+async def fetch_index(client):
+    index_data = {}
+    total_pages = 1
+    page = 1
+    while page <= total_pages:
+        resp = await client.post(
+            search_url,
+            json={
+                "page": page,
+                "size": 50,
+                "lib": "qb",
+                "searchParams": {
+                    "userSearchType": 1,
+                    "isAdvSearch": "0",
+                    "selectValue": "qw",
+                    "lib": "cpwsAl_qb",
+                    "sort_field": "",
+                },
+            },
+        )
+        if total_pages == 1:
+            total = resp.json()["data"]["totalCount"]
+            total_pages = (total + 50) // 50
+        if not index_data:
+            index_data = resp.json()
+        else:
+            index_data["data"]["datas"].extend(resp.json()["data"]["datas"])
+        logger.info(f"Page {page} of {total_pages} downloaded")
+        page += 1
+    return index_data
+
+
+async def main(config, index_json, csv, doc_dir):
+    async with httpx.AsyncClient(
+        headers=config["headers"],
+        transport=httpx.AsyncHTTPTransport(http2=True, limits=__LIMITS__, retries=3),
+        timeout=__TIMEOUT__,
+    ) as client:
+        index_data = {}
+        if index_json.is_file():
+            with open(index_json, "r", encoding="utf8") as f:
+                index_data = json.load(f)
+        else:
+            index_data = await fetch_index(client)
+            print(f"Index downloaded with msg {index_data['msg']}")
+            with open(index_json, "w", encoding="utf8") as f:
+                json.dump(index_data, f, ensure_ascii=False, indent=4)
+
+        # transform to csv
+        pacsv.write_csv(to_table(index_data["data"]["datas"]), csv)
+
+        sem = asyncio.Semaphore(config["threads"])
+        tasks = [
+            downloader(client, data, doc_dir, sem)
+            for data in index_data["data"]["datas"]
+        ]
+        loop = tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Downloading...")
+        status_dict = {"success": 0, "failed": 0, "last_error": ""}
+        for task in loop:
+            result = await task
+            if isinstance(result, Path):
+                status_dict["success"] += 1
+            else:
+                status_dict["failed"] += 1
+                status_dict["last_error"] = str(result)
+            loop.set_postfix(status_dict)
+
+    return status_dict
 
 
 if __name__ == "__main__":
@@ -69,70 +170,9 @@ if __name__ == "__main__":
     #         "rmfyalk.court.gov.cn",
     #     )
 
-    with httpx.Client(headers=CONFIG["headers"]) as client:
-        index_data = {}
-        if index_json.is_file():
-            with open(index_json, "r", encoding="utf8") as f:
-                index_data = json.load(f)
-        else:
-            total_pages = 1
-            page = 1
-            while page <= total_pages:
-                resp = client.post(
-                    search_url,
-                    json={
-                        "page": page,
-                        "size": 50,
-                        "lib": "qb",
-                        "searchParams": {
-                            "userSearchType": 1,
-                            "isAdvSearch": "0",
-                            "selectValue": "qw",
-                            "lib": "cpwsAl_qb",
-                            "sort_field": "",
-                        },
-                    },
-                )
-                if total_pages == 1:
-                    total = resp.json()["data"]["totalCount"]
-                    total_pages = (total + 50) // 50
-                if not index_data:
-                    index_data = resp.json()
-                else:
-                    index_data["data"]["datas"].extend(resp.json()["data"]["datas"])
-                logger.info(f"Page {page} of {total_pages} downloaded")
-                page += 1
-            print(f"Index downloaded with msg {index_data['msg']}")
-            with open(index_json, "w", encoding="utf8") as f:
-                json.dump(index_data, f, ensure_ascii=False, indent=4)
+    status_dict = asyncio.run(main(CONFIG, index_json, csv, doc_dir))
 
-        # transform to csv
-        df = pd.DataFrame(index_data["data"]["datas"])
-        df.to_csv(csv)
-
-        pool = ThreadPool(CONFIG["threads"])
-
-        results = pool.imap(
-            downloader,
-            zip(
-                repeat(client),
-                index_data["data"]["datas"],
-                repeat(doc_dir),
-            ),
-        )
-        loop = tqdm(
-            results, total=len(index_data["data"]["datas"]), desc="Downloading..."
-        )
-        status_dict = {"success": 0, "failed": 0, "last_error": ""}
-        for result in loop:
-            if isinstance(result, Path):
-                status_dict["success"] += 1
-            else:
-                status_dict["failed"] += 1
-                status_dict["last_error"] = str(result)
-            loop.set_postfix(status_dict)
-
-        if status_dict["failed"]:
-            exit(1)
-        else:
-            exit(0)
+    if status_dict["failed"]:
+        exit(1)
+    else:
+        exit(0)
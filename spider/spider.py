@@ -1,14 +1,18 @@
-import json
+import asyncio
+import os
 import zipfile
-from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from multiprocessing.pool import ThreadPool
 from pathlib import Path
 from shutil import rmtree
+from time import monotonic
 from traceback import print_exc
 
 import httpx
+import orjson
 import xmltodict
 from loguru import logger
+from lxml import etree
 from rich.progress import (
     BarColumn,
     DownloadColumn,
@@ -26,12 +30,199 @@ __HEADERS__ = {
 }
 
 
+# ~128 KiB reads keep per-chunk overhead low without large buffers
+__CHUNK_SIZE__ = 128 * 1024
+
+# Downloads are written through this much buffer, so the OS sees 1 MiB writes
+__WRITE_BUFFER_SIZE__ = 1024 * 1024
+
+# Seconds between progress bar updates while a download streams
+__PROGRESS_INTERVAL__ = 0.05
+
+# Files at least this large are downloaded as __RANGE_PARTS__ concurrent byte
+# ranges, at most __RANGE_CONCURRENCY__ in flight at once
+__RANGE_MIN_SIZE__ = 4 * 1024 * 1024
+
+__RANGE_PARTS__ = 8
+
+__RANGE_CONCURRENCY__ = 6
+
+# One progress display shared by all downloads; entered once around the
+# download phase instead of being rebuilt for every attempt
+__NET_PROGRESS__ = Progress(
+    TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
+    TextColumn("•"),
+    BarColumn(bar_width=None),
+    TextColumn("•"),
+    DownloadColumn(),
+    TextColumn("•"),
+    TransferSpeedColumn(),
+    TextColumn("•"),
+    TimeRemainingColumn(),
+)
+
+
+class RangeNotSupported(Exception):
+    """A ranged GET was not answered with 206 Partial Content."""
+
+
+async def _download_part(
+    client: httpx.AsyncClient,
+    url: str,
+    parts_path: Path,
+    part: list,
+    progress: Progress,
+    task_id,
+    sem: asyncio.Semaphore,
+    *args,
+    **kwargs,
+):
+    """
+    Download the byte range part = [start, end] into its place in parts_path.
+
+    part[0] is advanced as bytes are written, so a retry only fetches the rest.
+    """
+    async with sem:
+        headers_with_range = __HEADERS__.copy()
+        headers_with_range["Range"] = f"bytes={part[0]}-{part[1]}"
+        with open(parts_path, "r+b", buffering=__WRITE_BUFFER_SIZE__) as f:
+            f.seek(part[0])
+            async with client.stream(
+                "GET",
+                url,
+                headers=headers_with_range,
+                *args,
+                **kwargs,
+            ) as response:
+                if response.status_code != 206:
+                    raise RangeNotSupported(
+                        f"Range request answered with {response.status_code}"
+                    )
+                # progress is advanced in batches, at most every
+                # __PROGRESS_INTERVAL__ seconds
+                pending = 0
+                last_update = monotonic()
+                try:
+                    async for chunk in response.aiter_bytes(__CHUNK_SIZE__):
+                        f.write(chunk)
+                        part[0] += len(chunk)
+                        pending += len(chunk)
+                        if monotonic() - last_update >= __PROGRESS_INTERVAL__:
+                            progress.update(task_id, advance=pending)
+                            pending = 0
+                            last_update = monotonic()
+                finally:
+                    progress.update(task_id, advance=pending)
+
+
+def _load_parts(state_path: Path, parts_path: Path, total_size: int):
+    """Remaining byte ranges saved by an earlier attempt, or None."""
+    try:
+        state = orjson.loads(state_path.read_bytes())
+        if (
+            state["total_size"] == total_size
+            and parts_path.stat().st_size == total_size
+        ):
+            return state["parts"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+async def range_download(
+    client: httpx.AsyncClient,
+    url: str,
+    file_path: Path,
+    tmp_path: Path,
+    total_size: int,
+    progress: Progress,
+    task_id,
+    retry=3,
+    *args,
+    **kwargs,
+) -> Path:
+    """
+    Download a file as concurrent byte ranges written into a preallocated file.
+
+    The remaining range of each part is saved next to the file after every
+    attempt, so a later call resumes instead of starting over. Raises
+    RangeNotSupported if the server does not answer ranges with 206.
+    """
+    # A preallocated file has its final size before it is complete, so it is
+    # kept apart from tmp_path, whose size is what marks a finished download
+    parts_path = tmp_path.with_name(f"{tmp_path.name}.parts")
+    # The offsets are only saved while no part has the file open, so they
+    # never run ahead of the bytes written to it
+    state_path = parts_path.with_name(f"{parts_path.name}.json")
+
+    parts = _load_parts(state_path, parts_path, total_size)
+    if parts is None:
+        with open(parts_path, "wb") as f:
+            f.truncate(total_size)
+            # Reserve the blocks up front where supported rather than leaving
+            # a sparse file for the filesystem to fill in piece by piece
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(f.fileno(), 0, total_size)
+
+        step = -(-total_size // __RANGE_PARTS__)
+        parts = [
+            [start, min(start + step, total_size) - 1]
+            for start in range(0, total_size, step)
+        ]
+    sem = asyncio.Semaphore(__RANGE_CONCURRENCY__)
+
+    remaining = sum(max(0, part[1] - part[0] + 1) for part in parts)
+    progress.update(task_id, completed=total_size - remaining)
+    progress.start_task(task_id)
+    try:
+        while retry >= 0:
+            retry -= 1
+            results = await asyncio.gather(
+                *[
+                    _download_part(
+                        client,
+                        url,
+                        parts_path,
+                        part,
+                        progress,
+                        task_id,
+                        sem,
+                        *args,
+                        **kwargs,
+                    )
+                    for part in parts
+                    if part[0] <= part[1]
+                ],
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, RangeNotSupported):
+                    # the parts are of no use to a sequential download
+                    parts_path.unlink(missing_ok=True)
+                    state_path.unlink(missing_ok=True)
+                    raise result
+                if isinstance(result, Exception):
+                    logger.error(f"Error downloading range: {result}")
+
+            if all(part[0] > part[1] for part in parts):
+                parts_path.rename(file_path)
+                state_path.unlink(missing_ok=True)
+                return file_path
+    finally:
+        progress.stop_task(task_id)
+        if parts_path.is_file():
+            state_path.write_bytes(
+                orjson.dumps({"total_size": total_size, "parts": parts})
+            )
+
+
 async def continuous_download(
     client: httpx.AsyncClient,
     url: str,
     file_path: Path,
     tmp_path: Path,
     retry=3,
+    progress: Progress = None,
     *args,
     **kwargs,
 ) -> Path:
@@ -39,46 +230,63 @@ async def continuous_download(
     Continuously download a file from a URL.
 
     """
+    if progress is None:
+        progress = __NET_PROGRESS__
+
     file_info = await client.head(url)
 
     # Get the total file size from headers
     total_size = int(file_info.headers.get("content-length", 0))
 
-    while retry >= 0:
-        retry -= 1
-        # Check if we have a partially downloaded file
-        downloaded_size = 0
-        if tmp_path.is_file():
-            if tmp_path.stat().st_size <= total_size:
+    task_id = progress.add_task(
+        "download",
+        filename=file_path.name,
+        start=False,
+        total=total_size,
+    )
+    try:
+        # Large files from servers that accept ranges are fetched as parallel
+        # parts, unless an earlier sequential attempt left a partial file
+        if (
+            file_info.headers.get("accept-ranges") == "bytes"
+            and total_size >= __RANGE_MIN_SIZE__
+            and not tmp_path.is_file()
+        ):
+            try:
+                return await range_download(
+                    client,
+                    url,
+                    file_path,
+                    tmp_path,
+                    total_size,
+                    progress,
+                    task_id,
+                    retry,
+                    *args,
+                    **kwargs,
+                )
+            except RangeNotSupported as e:
+                logger.warning(f"{e}, downloading sequentially")
+
+        while retry >= 0:
+            retry -= 1
+            # Check if we have a partially downloaded file, with a single stat
+            try:
                 downloaded_size = tmp_path.stat().st_size
-            else:
+            except FileNotFoundError:
+                downloaded_size = 0
+            if downloaded_size > total_size:
                 tmp_path.unlink()
+                downloaded_size = 0
+
+            # Resume download from where it left off
+            headers_with_range = __HEADERS__.copy()
+            headers_with_range["Range"] = f"bytes={downloaded_size}-"
 
-        # Resume download from where it left off
-        headers_with_range = __HEADERS__.copy()
-        headers_with_range["Range"] = f"bytes={downloaded_size}-"
-
-        with Progress(
-            TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
-            TextColumn("•"),
-            BarColumn(bar_width=None),
-            TextColumn("•"),
-            DownloadColumn(),
-            TextColumn("•"),
-            TransferSpeedColumn(),
-            TextColumn("•"),
-            TimeRemainingColumn(),
-        ) as __NET_PROGRESS__:
-            task_id = __NET_PROGRESS__.add_task(
-                "download",
-                filename=file_path.name,
-                start=False,
-                total=total_size,
-            )
             try:
-                with open(tmp_path, "ab") as f:
-                    __NET_PROGRESS__.update(task_id, completed=downloaded_size)
-                    __NET_PROGRESS__.start_task(task_id)
+                with open(tmp_path, "ab", buffering=__WRITE_BUFFER_SIZE__) as f:
+                    progress.update(task_id, completed=downloaded_size)
+                    progress.start_task(task_id)
                     async with client.stream(
                         "GET",
                         url,
@@ -86,26 +294,84 @@ async def continuous_download(
                         *args,
                         **kwargs,
                     ) as response:
-                        async for chunk in response.aiter_bytes():
-                            f.write(chunk)
-                            __NET_PROGRESS__.update(task_id, advance=len(chunk))
+                        # progress is advanced in batches, at most every
+                        # __PROGRESS_INTERVAL__ seconds
+                        pending = 0
+                        last_update = monotonic()
+                        try:
+                            async for chunk in response.aiter_bytes(__CHUNK_SIZE__):
+                                f.write(chunk)
+                                pending += len(chunk)
+                                if monotonic() - last_update >= __PROGRESS_INTERVAL__:
+                                    progress.update(task_id, advance=pending)
+                                    pending = 0
+                                    last_update = monotonic()
+                        finally:
+                            progress.update(task_id, advance=pending)
             except Exception as e:
                 print_exc()
                 logger.error(f"Error downloading file: {e}")
             finally:
-                __NET_PROGRESS__.stop_task(task_id)
+                progress.stop_task(task_id)
 
-            if not tmp_path.is_file():
+            try:
+                size = tmp_path.stat().st_size
+            except FileNotFoundError:
                 continue
-            if tmp_path.stat().st_size == total_size:
+            if size == total_size:
                 # File is already completely downloaded
                 tmp_path.rename(file_path)
                 return file_path
-            elif tmp_path.stat().st_size > total_size:
+            elif size > total_size:
                 tmp_path.unlink()
+    finally:
+        progress.remove_task(task_id)
+
+
+def _extract_members(file: Path, names, dest: Path):
+    with zipfile.ZipFile(file, "r") as zip_ref:
+        for name in names:
+            try:
+                zip_ref.extract(name, dest)
+            except FileExistsError:
+                # another worker created the directory between zipfile's
+                # exists check and its makedirs; it is there now
+                zip_ref.extract(name, dest)
+
 
+def extract_zip(file: Path, dest: Path):
+    """Extract a zip archive across worker processes."""
+    with zipfile.ZipFile(file, "r") as zip_ref:
+        names = zip_ref.namelist()
+
+    # inflating is CPU bound, so each worker opens the archive itself and
+    # extracts an interleaved share of the members
+    workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(
+            _extract_members,
+            [file] * workers,
+            [names[i::workers] for i in range(workers)],
+            [dest] * workers,
+        ):
+            pass
+
+
+def new_client() -> httpx.AsyncClient:
+    """Client shared by all requests of a run, so retries reuse its pool."""
+    return httpx.AsyncClient(
+        headers=__HEADERS__,
+        http2=True,
+        # a large download may stall between chunks; only connecting is bounded
+        timeout=httpx.Timeout(10.0, read=None),
+    )
+
+
+async def init_contents(root: Path, retry=3, client: httpx.AsyncClient = None):
+    if client is None:
+        async with new_client() as client:
+            return await init_contents(root, retry, client)
 
-async def init_contents(root: Path, retry=3):
     CONTENTS_URL = (
         "https://laws.e-gov.go.jp/bulkdownload?file_section=1&only_xml_flag=true"
     )
@@ -117,8 +383,7 @@ async def init_contents(root: Path, retry=3):
     async def unzip(file: Path, dest: Path, overwrite=True):
         try:
             CONTENTS_DIR.mkdir(parents=True, exist_ok=overwrite)
-            with zipfile.ZipFile(CONTENTS_FILE, "r") as zip_ref:
-                zip_ref.extractall(CONTENTS_DIR)
+            extract_zip(CONTENTS_FILE, CONTENTS_DIR)
             return CONTENTS_DIR
         except Exception as e:
             if CONTENTS_DIR.is_dir():
@@ -132,14 +397,13 @@ async def init_contents(root: Path, retry=3):
         try:
             if not CONTENTS_FILE.is_file():
                 logger.info("Downloading contents")
-                async with httpx.AsyncClient(headers=__HEADERS__) as client:
-                    assert CONTENTS_FILE == await continuous_download(
-                        client,
-                        CONTENTS_URL,
-                        CONTENTS_FILE,
-                        CONTENTS_TEMP,
-                    ), Exception("Failed to download contents")
-                    logger.info("Contents downloaded")
+                assert CONTENTS_FILE == await continuous_download(
+                    client,
+                    CONTENTS_URL,
+                    CONTENTS_FILE,
+                    CONTENTS_TEMP,
+                ), Exception("Failed to download contents")
+                logger.info("Contents downloaded")
             assert CONTENTS_DIR == await unzip(CONTENTS_FILE, CONTENTS_DIR), Exception(
                 "Failed to unzip contents"
             )
@@ -152,45 +416,101 @@ async def init_contents(root: Path, retry=3):
     return CONTENTS_DIR
 
 
-async def xml_to_json(input_path, output_path, callback=None, overwrite=False):
+# libxml2 refuses text nodes over 10MB without huge_tree; entities are never
+# resolved, matching xmltodict which rejects entity declarations
+__XML_PARSER__ = etree.XMLParser(huge_tree=True, resolve_entities=False)
+
+
+def _elem_to_dict(element):
+    """Convert an lxml element into the value xmltodict.parse gives for it."""
+    item = {f"@{k}": v for k, v in element.attrib.items()} or None
+    texts = [element.text] if element.text else []
+    for child in element:
+        # text after a child belongs to this element, even after a comment
+        if child.tail:
+            texts.append(child.tail)
+        if not isinstance(child.tag, str):
+            # comments and processing instructions are dropped like xmltodict
+            continue
+        value = _elem_to_dict(child)
+        if item is None:
+            item = {}
+        tag = child.tag
+        if tag not in item:
+            item[tag] = value
+        elif isinstance(item[tag], list):
+            item[tag].append(value)
+        else:
+            item[tag] = [item[tag], value]
+
+    text = "".join(texts).strip() or None
+    if item is None:
+        return text
+    if text:
+        item["#text"] = text
+    return item
+
+
+def fast_xml_to_dict(input_path):
+    """Parse an XML file with lxml into xmltodict's dict shape."""
+    root = etree.parse(str(input_path), __XML_PARSER__).getroot()
+    if root.nsmap:
+        # xmltodict keeps prefixed names and xmlns attributes, which lxml
+        # resolves away; leave namespaced documents to xmltodict
+        with open(input_path, "rb") as input_file:
+            return xmltodict.parse(input_file)
+    return {root.tag: _elem_to_dict(root)}
+
+
+def xml_to_json(input_path, output_path, callback=None, overwrite=False):
     if not output_path:
         output_path = input_path.parent / f"{input_path.stem}.json"
     if output_path.is_file() and not overwrite:
         return output_path
-    with open(input_path, "r", encoding="utf-8") as input_file:
-        xml = input_file.read()
-        d = xmltodict.parse(xml)
-        with open(output_path, "w", encoding="utf-8") as output_file:
-            json.dump(
-                d,
-                output_file,
-                ensure_ascii=False,
-            )
+    # libxml2 reads the file in blocks, so the XML text is never held in
+    # memory as a whole next to the parsed dict
+    d = fast_xml_to_dict(input_path)
+    # orjson writes UTF-8 bytes directly
+    output_path.write_bytes(orjson.dumps(d))
     if callback:
         callback()
 
 
-async def xml_dir_walker(dir: Path, suffix_filter=[".xml"]):
-    for file in dir.iterdir():
-        if file.is_file():
-            if file.suffix in suffix_filter:
-                yield file
-            else:
-                logger.debug(f"Skipping {file}")
-        elif file.is_dir():
-            async for r_file in xml_dir_walker(
-                file,
-                suffix_filter=suffix_filter,
-            ):
-                yield r_file
+def xml_dir_walker(dir: Path, suffix_filter=[".xml"]):
+    # plain generator over scandir: entries carry their file type, and nothing
+    # here awaits
+    with os.scandir(dir) as it:
+        for entry in it:
+            if entry.is_file():
+                if os.path.splitext(entry.name)[1] in suffix_filter:
+                    yield Path(entry.path)
+                else:
+                    logger.debug(f"Skipping {entry.path}")
+            elif entry.is_dir():
+                yield from xml_dir_walker(
+                    entry.path,
+                    suffix_filter=suffix_filter,
+                )
 
 
 async def main():
-    contents_dir = await init_contents(ROOT / "data")
+    async with new_client() as client:
+        with __NET_PROGRESS__:
+            contents_dir = await init_contents(ROOT / "data", client=client)
     JSON_DOCUMENTS_DIR = ROOT / "data" / "json_documents"
     JSON_DOCUMENTS_DIR.mkdir(parents=True, exist_ok=True)
 
-    xml_file_list = [file async for file in xml_dir_walker(contents_dir)]
+    # Files converted by an earlier run are dropped before anything is
+    # scheduled; one listing of the output dir replaces a stat per file
+    with os.scandir(JSON_DOCUMENTS_DIR) as it:
+        converted = {entry.name for entry in it}
+    xml_file_list = []
+    total_found = 0
+    for file in xml_dir_walker(contents_dir):
+        total_found += 1
+        if f"{file.stem}.json" not in converted:
+            xml_file_list.append(file)
+    logger.info(f"{total_found - len(xml_file_list)} files already converted")
 
     with Progress(
         TextColumn("[bold blue]Converting xml to json:", justify="right"),
@@ -208,19 +528,17 @@ async def main():
             "convert",
             total=len(xml_file_list),
         )
-        task_list = []
-        for file in xml_file_list:
-            task_list.append(
-                asyncio.create_task(
-                    xml_to_json(
-                        file,
-                        JSON_DOCUMENTS_DIR / f"{file.stem}.json",
-                        partial(__FILE_PROGRESS__.update, task_id, advance=1),
-                    ),
-                )
+        # xmltodict and orjson are CPU bound, so the files are spread over
+        # worker processes rather than asyncio tasks
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = executor.map(
+                xml_to_json,
+                xml_file_list,
+                [JSON_DOCUMENTS_DIR / f"{file.stem}.json" for file in xml_file_list],
+                chunksize=32,
             )
-
-        await asyncio.gather(*task_list)
+            for _ in results:
+                __FILE_PROGRESS__.update(task_id, advance=1)
 
         __FILE_PROGRESS__.stop_task(task_id)
 
@@ -228,6 +546,4 @@ async def main():
 
 
 if __name__ == "__main__":
-    import asyncio
-
     asyncio.run(main())
@@ -1,15 +1,15 @@
-import json
+import asyncio
+import csv
+import hashlib
 import zipfile
 from functools import partial
-from itertools import repeat
-from multiprocessing.pool import ThreadPool
 from pathlib import Path
 from shutil import rmtree
 from traceback import print_exc
-import pandas as pd
-from time import sleep
+from time import sleep, time
 from urllib.parse import urlparse
 import httpx
+import orjson
 from loguru import logger
 from rich.progress import (
     BarColumn,
@@ -27,12 +27,34 @@ __HEADERS__ = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/142.0.0.0 Safari/537.36",
 }
 
-__CHUNK_SIZE__ = 1024 * 10
+__CHUNK_SIZE__ = 128 * 1024
 
-__THREAD_NUM__ = 1
+__CONCURRENCY__ = 16
 
 __PROXY__ = None
 
+# Streaming responses log their progress once per this many bytes
+__LOG_INTERVAL_BYTES__ = 1024 * 1024
+
+
+# Batch responses carry the document download links, which may expire, so a
+# cached response is only reused for this many seconds
+__BATCH_CACHE_TTL__ = 12 * 60 * 60
+
+
+def batch_cache_path(path, body):
+    """Cache file for a batch request next to the contents file, keyed by its body."""
+    digest = hashlib.sha256(orjson.dumps(body)).hexdigest()
+    return path.parent / f"{path.stem}_batch" / f"{digest}.json"
+
+
+def is_fresh(file, ttl):
+    """Whether file exists and was written less than ttl seconds ago."""
+    try:
+        return time() - file.stat().st_mtime < ttl
+    except FileNotFoundError:
+        return False
+
 
 def init_contents(path=None, retry=3):
 
@@ -53,15 +75,17 @@ def init_contents(path=None, retry=3):
         ) as client:
             contents = None
             try:
-                with open(path, "r", encoding="utf8") as f:
-                    contents = json.load(f)
+                with open(path, "rb") as f:
+                    contents = orjson.loads(f.read())
             except:
                 print_exc()
                 pass
             if not contents:
                 # response = client.post(CONTENTS_URL, json=data)
-                resp_bytes = []
+                # chunks go straight into one buffer that orjson parses as is
+                resp_bytes = bytearray()
                 total = 0
+                logged = 0
 
                 with client.stream(
                     "POST",
@@ -71,62 +95,76 @@ def init_contents(path=None, retry=3):
                 ) as resp:
                     resp.raise_for_status()
                     for chunk in resp.iter_bytes(chunk_size=__CHUNK_SIZE__):
-                        resp_bytes.append(chunk)
+                        resp_bytes.extend(chunk)
                         total += len(chunk)
-                        logger.info(
-                            f"Fetched {len(chunk)} bytes, total {total/8/1024} KB"
-                        )
-                    contents = json.loads(b"".join(resp_bytes).decode("utf-8"))
+                        if total - logged >= __LOG_INTERVAL_BYTES__:
+                            logger.info(f"Fetched {total/1024:.0f} KB")
+                            logged = total
+                    logger.info(f"Fetched {total/1024:.0f} KB in total")
+                    contents = orjson.loads(resp_bytes)
             if not contents["code"] == 200:
                 raise Exception("Failed to download contents")
             if path:
-                with open(path, "w", encoding="utf8") as f:
-                    json.dump(contents, f, ensure_ascii=False)
+                with open(path, "wb") as f:
+                    f.write(orjson.dumps(contents))
             logger.info(f"Contents downloaded with msg {contents['msg']}")
 
-            batch_data = None
-            resp_bytes = []
+            all_data = []
+            msg = None
             total = 0
+            logged = 0
             step = 2000
             total_part = len(contents["rows"]) // step + int(
                 len(contents["rows"]) % step > 0
             )
 
             for i in range(total_part):
-                with client.stream(
-                    "POST",
-                    BATCH_URL,
-                    json=[
-                        {"bbbs": c["bbbs"], "format": "docx"}
-                        for c in contents["rows"][i * step : (i + 1) * step]
-                    ],
-                    timeout=1000,
-                ) as resp:
-                    resp.raise_for_status()
-                    for chunk in resp.iter_bytes(chunk_size=__CHUNK_SIZE__):
-                        resp_bytes.append(chunk)
-                        total += len(chunk)
-                        logger.info(
-                            f"Part [{i+1}/{total_part}], fetched {len(chunk)} bytes, total {total/8/1024} KB"
-                        )
-                    if not batch_data:
-                        batch_data = json.loads(b"".join(resp_bytes).decode("utf-8"))
-                    else:
-                        _data = json.loads(b"".join(resp_bytes).decode("utf-8"))
-                        batch_data["data"].extend(_data["data"])
-                    resp_bytes = []
-            assert (
-                batch_data and batch_data["code"] == 200
-            ), f"Failed to fetch batch with msg {batch_data['msg']}"
-            logger.info(f"Batch meta data fetched with msg {batch_data['msg']}")
-            return batch_data["data"]
+                body = [
+                    {"bbbs": c["bbbs"], "format": "docx"}
+                    for c in contents["rows"][i * step : (i + 1) * step]
+                ]
+                cache_file = batch_cache_path(path, body) if path else None
+                cached = bool(cache_file) and is_fresh(cache_file, __BATCH_CACHE_TTL__)
+                if cached:
+                    logger.info(f"Part [{i+1}/{total_part}] loaded from cache")
+                    buf = cache_file.read_bytes()
+                else:
+                    # fresh buffer per part, parsed by orjson as is
+                    buf = bytearray()
+                    with client.stream(
+                        "POST",
+                        BATCH_URL,
+                        json=body,
+                        timeout=1000,
+                    ) as resp:
+                        resp.raise_for_status()
+                        for chunk in resp.iter_bytes(chunk_size=__CHUNK_SIZE__):
+                            buf.extend(chunk)
+                            total += len(chunk)
+                            if total - logged >= __LOG_INTERVAL_BYTES__:
+                                logger.info(
+                                    f"Part [{i+1}/{total_part}], fetched {total/1024:.0f} KB in total"
+                                )
+                                logged = total
+                part = orjson.loads(buf)
+                assert (
+                    part["code"] == 200
+                ), f"Failed to fetch batch part {i+1} with msg {part['msg']}"
+                if cache_file and not cached:
+                    cache_file.parent.mkdir(parents=True, exist_ok=True)
+                    cache_file.write_bytes(buf)
+                # only the decoded rows are kept across parts
+                all_data.extend(part["data"])
+                msg = part["msg"]
+            assert msg is not None, "Failed to fetch batch, no contents"
+            logger.info(f"Batch meta data fetched with msg {msg}")
+            return all_data
     except Exception as e:
         print_exc()
         return e
 
 
-def download_item(args, retry=3):
-    client, row, dir = args
+async def download_item(client, row, dir, sem, retry=3):
     url = row["url"]
     parsed_url = urlparse(url)
     path_parts = parsed_url.path.split("/")
@@ -139,37 +177,43 @@ def download_item(args, retry=3):
     if tmp_path.is_file():
         tmp_path.unlink()
 
-    while retry > 0:
-        retry -= 1
-        try:
-            with client.stream("GET", url) as response:
+    async with sem:
+        while retry > 0:
+            retry -= 1
+            try:
+                async with client.stream("GET", url) as response:
 
-                if response.status_code != 200:
-                    raise Exception(f"Failed to download file: {response.status_code}")
+                    if response.status_code != 200:
+                        raise Exception(
+                            f"Failed to download file: {response.status_code}"
+                        )
 
-                with open(tmp_path, "wb") as f:
-                    for chunk in response.iter_bytes(__CHUNK_SIZE__):
-                        f.write(chunk)
+                    with open(tmp_path, "wb") as f:
+                        async for chunk in response.aiter_bytes(__CHUNK_SIZE__):
+                            f.write(chunk)
 
-            file_path.unlink(missing_ok=True)
-            tmp_path.rename(file_path)
-            return file_path
-        except Exception as e:
-            print_exc()
-            logger.error(f"Failed to download file: {e}")
+                file_path.unlink(missing_ok=True)
+                tmp_path.rename(file_path)
+                return file_path
+            except Exception as e:
+                print_exc()
+                logger.error(f"Failed to download file: {e}")
 
 
-def main():
+async def main():
     contents = init_contents(ROOT / "cn_data_full.json")
     assert isinstance(contents, list), contents
     JSON_DOCUMENTS_DIR = ROOT / "data_cn_full" / "documents"
     JSON_DOCUMENTS_DIR.mkdir(parents=True, exist_ok=True)
 
-    # contents (dict) to dataframe and store csv
-    df = pd.DataFrame(contents)
-    df.to_csv(JSON_DOCUMENTS_DIR.parent / "index.csv", index=False)
-
-    pool = ThreadPool(__THREAD_NUM__)
+    # contents (dict) to csv, columns are the union of the row keys
+    fieldnames = list(dict.fromkeys(k for row in contents for k in row))
+    with open(
+        JSON_DOCUMENTS_DIR.parent / "index.csv", "w", newline="", encoding="utf-8"
+    ) as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(contents)
 
     with Progress(
         TextColumn("[bold blue]Converting xml to json:", justify="right"),
@@ -183,21 +227,25 @@ def main():
         TimeRemainingColumn(),
     ) as __FILE_PROGRESS__:
 
-        with httpx.Client(headers=__HEADERS__, proxy=__PROXY__) as client:
-            results = pool.imap(
-                download_item,
-                zip(
-                    repeat(client),
-                    contents,
-                    repeat(JSON_DOCUMENTS_DIR),
-                ),
-            )
+        # Small files from one host: many concurrent streams multiplexed over
+        # a few HTTP/2 connections
+        async with httpx.AsyncClient(
+            headers=__HEADERS__,
+            proxy=__PROXY__,
+            http2=True,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+        ) as client:
+            sem = asyncio.Semaphore(__CONCURRENCY__)
+            tasks = [
+                download_item(client, row, JSON_DOCUMENTS_DIR, sem) for row in contents
+            ]
 
             task_id = __FILE_PROGRESS__.add_task(
                 "convert",
                 total=len(contents),
             )
-            for result in results:
+            for task in asyncio.as_completed(tasks):
+                result = await task
                 if isinstance(result, Path):
                     __FILE_PROGRESS__.update(task_id, advance=1)
 
@@ -208,4 +256,4 @@ def main():
 
 if __name__ == "__main__":
 
-    main()
+    asyncio.run(main())